@@ -11,7 +11,7 @@ _export_sizes() {
 
 _export_sizes ""
 
-for LETTER in "T" "C" "M" ; do
+for LETTER in "T" "C" "M" "G" "B" "F" "D" ; do
 	SVG_NAME_DIFF="-$LETTER"
 	LETTER_SVG=$DIR/poco$SVG_NAME_DIFF.svg
 	cp $DIR/poco-layout.svg $LETTER_SVG
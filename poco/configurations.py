@@ -15,7 +15,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import configparser, os
+import configparser, os, sys
 from xdg import BaseDirectory as base
 from xdg import DesktopEntry as desktop
 from configparser import ConfigParser
@@ -28,6 +28,7 @@ DEFAULT_POSITION = 'bottom'
 DEFAULT_WIDTH = '800'
 DEFAULT_AUTO_HINT = 'true'
 DEFAULT_AUTO_SELECT_FIRST_HINT = 'true'
+DEFAULT_RELAYOUT_DELAY = '0'
 
 
 autostart_dir = base.save_config_path("autostart")
@@ -72,6 +73,9 @@ if not parser.has_section('layout'):
 if not parser.has_option('layout', 'remove_decorations'):
 	parser.set('layout', 'remove_decorations', 'false')
 	need_write = True
+if not parser.has_option('layout', 'relayout_delay'):
+	parser.set('layout', 'relayout_delay', DEFAULT_RELAYOUT_DELAY)
+	need_write = True
 if need_write:
 	with open(config_file_path, 'w') as f:
 		parser.write(f)
@@ -143,6 +147,38 @@ def set_remove_decorations(remove):
 		parser.write(f)
 
 
+def get_relayout_delay():
+	"""
+	Milliseconds to wait for more window events before a relayout, 0 to relayout once per main loop iteration
+	"""
+	try:
+		return parser.getint('layout', 'relayout_delay')
+	except configparser.NoOptionError:
+		return int(DEFAULT_RELAYOUT_DELAY)
+	except ValueError:
+		print(
+			'relayout_delay is not a number of milliseconds: {}, using {}'.format(
+				parser.get('layout', 'relayout_delay'), DEFAULT_RELAYOUT_DELAY),
+			file=sys.stderr)
+		return int(DEFAULT_RELAYOUT_DELAY)
+
+
+def get_rules():
+	"""
+	Options of the [rule:<name>] sections, in the order they appear in the file. A section
+	that can not be read is reported and left out
+	"""
+	rules = []
+	for section in parser.sections():
+		if not section.startswith('rule:'):
+			continue
+		try:
+			rules.append(dict(parser.items(section)))
+		except configparser.InterpolationError as e:
+			print('ignoring [{}]: {}'.format(section, e))
+	return rules
+
+
 def is_autostart():
 	dfile = desktop.DesktopEntry(autostart_file)
 	return bool(dfile.get("X-GNOME-Autostart-enabled", type="boolean"))
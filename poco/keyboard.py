@@ -1,14 +1,18 @@
-import gi, threading, sys
+import gi, threading, sys, struct
+from collections import namedtuple
 from Xlib import X
 from Xlib.ext import record
 from Xlib.display import Display
-from Xlib.protocol import rq
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gdk', '3.0')
 from gi.repository import Gtk, Gdk, GObject, GLib
 
 MODIFIERS = [Gdk.ModifierType.CONTROL_MASK, Gdk.ModifierType.SHIFT_MASK,
 			Gdk.ModifierType.MOD1_MASK, Gdk.ModifierType.MOD4_MASK]
+# the fields of a 32 bytes core key event read by the listener: type, detail (key code), time and state
+KEY_EVENT = struct.Struct('=BBxxI20xH2x')
+SENT_EVENT_FLAG = 0x80
+KeyEvent = namedtuple('KeyEvent', 'detail state time keyval')
 CONTEXT_FILTER = [{
 		'core_requests': (0, 0), 'core_replies': (0, 0),
 		'ext_requests': (0, 0, 0, 0), 'ext_replies': (0, 0, 0, 0),
@@ -75,10 +79,8 @@ class KeyboardListener:
 		self.root = self.well_connection.screen().root
 		self.root.change_attributes(event_mask=X.KeyPressMask | X.KeyReleaseMask)
 		self.modifiers_count = self.modified_count = 0
-		self.code_map = {}
-		self.composed_code_map = {}
-		self.composed_mapping_first_code = None
-		self.multiplier = ''
+		self.sequences = KeyNode()
+		self._reset_sequence()
 
 	#
 	# API
@@ -86,10 +88,7 @@ class KeyboardListener:
 	def bind(self, key):
 		if self.stopped:
 			return
-		if len(key.accelerators) == 1:
-			self._bind_single_accelerator(key)
-		elif len(key.accelerators) == 2:
-			self._bind_composed_accelerator(key)
+		self._bind_sequence(key)
 		self.well_connection.sync()
 		if self.stopped:
 			print(
@@ -144,90 +143,158 @@ class KeyboardListener:
 		self.root.grab_key(code, mask, True, X.GrabModeAsync, X.GrabModeAsync)
 		self.root.grab_key(code, mask | X.Mod2Mask, True, X.GrabModeAsync, X.GrabModeAsync)
 
-	def _bind_single_accelerator(self, key):
-		gdk_keyval, code, mask = parse_accelerator(key.accelerators[0])
-
-		self._grab_keys(code, mask)
-
-		if code not in self.code_map:
-			self.code_map[code] = {}
-
-		self.code_map[code][mask] = key
-
-	def _bind_composed_accelerator(self, key):
-		gdk_keyval, code, mask = parse_accelerator(key.accelerators[0])
-		second_gdk_keyval, second_code, second_mask = parse_accelerator(key.accelerators[1])
-
-		self._grab_keys(code, mask)
-
-		if code not in self.composed_code_map:
-			self.composed_code_map[code] = {}
-		if mask not in self.composed_code_map[code]:
-			self.composed_code_map[code][mask] = {}
-		if second_code not in self.composed_code_map[code][mask]:
-			self.composed_code_map[code][mask][second_code] = {}
-
-		if second_mask in self.composed_code_map[code][mask][second_code]:
-			raise Exception('key ({}) already mapped'.format(', '.join(key.accelerators)))
+	def _bind_sequence(self, key):
+		"""
+		Compiles the accelerators of the key into the sequence trie, only the first one is grabbed.
+		A key bound again replaces the previous one
+		"""
+		steps = [parse_accelerator(accelerator)[1:] for accelerator in key.accelerators]
+		self._check_sequence(key, steps)
+
+		self._grab_keys(*steps[0])
+
+		node = self.sequences
+		for i, step in enumerate(steps):
+			if step not in node.children:
+				node.children[step] = KeyNode()
+			node = node.children[step]
+			if i < len(steps) - 1:
+				node.set_timeout(tuple(steps), key.timeout)
+
+		if node.key:
+			print('Key ({}) mapped again, the last mapping wins'.format(', '.join(key.accelerators)), file=sys.stderr)
+		node.key = key
+
+	def _check_sequence(self, key, steps):
+		"""
+		A single key may also start longer sequences, as the prefix key does, but a sequence of
+		many keys can not end where another one goes on
+		"""
+		node = self.sequences
+		for i, step in enumerate(steps):
+			node = node.children.get(step)
+			if not node:
+				return
+			if (0 < i < len(steps) - 1 and node.key) or (0 < i == len(steps) - 1 and node.children):
+				raise Exception('key ({}) conflicts with a sequence already mapped'.format(', '.join(key.accelerators)))
 
-		self.composed_code_map[code][mask][second_code][second_mask] = key
+	def _reset_sequence(self):
+		self.node = None
+		self.node_time = 0
+		self.count = 1
+		self.multiplier = ''
 
 	#
 	# Event handling
 	#
 	def handler(self, reply):
+		"""
+		Decodes the recorded key events in place, without building python-xlib event objects.
+		Other events are skipped by their type byte, before any field is unpacked
+		"""
 		data = reply.data
-		while len(data):
-			event, data = rq.EventField(None).parse_binary_value(
-				data, self.recording_connection.display, None, None)
+		for offset in range(0, len(data) - KEY_EVENT.size + 1, KEY_EVENT.size):
+			event_type = data[offset] & ~SENT_EVENT_FLAG
+			if event_type != X.KeyPress and event_type != X.KeyRelease:
+				continue
+			_, code, time, state = KEY_EVENT.unpack_from(data, offset)
 
-			if event.detail in self.mod_keys_set:
-				self.modifiers_count += 1 if event.type == X.KeyPress else -1
+			if code in self.mod_keys_set:
+				self.modifiers_count += 1 if event_type == X.KeyPress else -1
 				self.modified_count = 0
 				continue
 
 			if self.modifiers_count:
-				self.modified_count += 1 if event.type == X.KeyPress else -1
-
-			if event.type == X.KeyPress:
-				self.handle_keypress(event)
+				self.modified_count += 1 if event_type == X.KeyPress else -1
 
-	def handle_keypress(self, event):
-		_wasmapped, keyval, egroup, level, consumed = Gdk.Keymap.get_default().translate_keyboard_state(
-			event.detail, Gdk.ModifierType(event.state), 0)
+			if event_type == X.KeyPress:
+				self.handle_keypress(code, state, time)
 
-		code = event.detail
-		event.keyval = keyval  # TODO: explain
-		mask = normalize_state(event.state)
+	def handle_keypress(self, code, state, time):
+		if not self.node and self.modified_count != 1:
+			# neither inside a sequence nor the first key pressed with modifiers
+			return
 
-		if self.composed_mapping_first_code and self.composed_mapping_first_code != (code, mask):
+		step = (code, normalize_state(state))
 
-			key_name = Gdk.keyval_name(event.keyval)
-			if not mask and key_name and key_name.isdigit():
-				self.multiplier = self.multiplier + key_name
-				return
+		if self.node and self.node.timeout is not None and time - self.node_time > self.node.timeout:
+			self._reset_sequence()
 
-			second_code_map = self.composed_code_map[self.composed_mapping_first_code[0]][self.composed_mapping_first_code[1]]
-			if code in second_code_map and mask in second_code_map[code]:
-				multiplier_int = int(self.multiplier) if self.multiplier else 1
-				self.callback(second_code_map[code][mask], event, multiplier=multiplier_int)
+		if self.node:
+			if not step[1]:
+				key_name = Gdk.keyval_name(self._keyval(code, state))
+				if key_name and key_name.isdigit():
+					self.multiplier = self.multiplier + key_name
+					return
 
-			self.composed_mapping_first_code = None
-
-		elif self.modified_count == 1:
+			if step in self.node.children:
+				self._reach(self.node.children[step], code, state, time)
+				return
 
-			if code in self.code_map and mask in self.code_map[code]:
-				self.callback(self.code_map[code][mask], event)
+			self._reset_sequence()
 
-			if code in self.composed_code_map and mask in self.composed_code_map[code]:
-				self.composed_mapping_first_code = (code, mask)
+		if self.modified_count == 1 and step in self.sequences.children:
+			self._reach(self.sequences.children[step], code, state, time)
 
-		self.multiplier = ''
+	def _keyval(self, code, state):
+		_wasmapped, keyval, egroup, level, consumed = Gdk.Keymap.get_default().translate_keyboard_state(
+			code, Gdk.ModifierType(state), 0)
+		return keyval
+
+	def _reach(self, node, code, state, time):
+		"""
+		Calls the key bound to the node, if any, and waits for the next step if the node
+		prefixes longer sequences. Counts typed along the way multiply, as in vim
+		"""
+		if self.multiplier:
+			self.count *= int(self.multiplier)
+			self.multiplier = ''
+		if node.key:
+			self.callback(node.key, KeyEvent(code, state, time, self._keyval(code, state)), multiplier=self.count)
+		if node.children:
+			self.node = node
+			self.node_time = time
+		else:
+			self._reset_sequence()
+
+
+class KeyNode:
+	"""
+	A step of the key sequences trie, keyed by key code and normalized mask, with the key
+	bound to the sequence ending here, if any. Sequences going through the node wait for
+	their next step at most timeout milliseconds, or forever if any of them has no timeout
+	"""
+
+	def __init__(self):
+		self.key = None
+		self.children = {}
+		self.timeout = None
+		# timeout of each sequence going through the node, by its steps, so a sequence bound again replaces its own
+		self.timeouts = {}
+
+	def set_timeout(self, steps, timeout):
+		self.timeouts[steps] = timeout
+		timeouts = list(self.timeouts.values())
+		self.timeout = None if None in timeouts else max(timeouts)
 
 
 class Key:
 
-	def __init__(self, accelerators, function, *parameters):
+	def __init__(self, accelerators, function, *parameters, coalesce=False, timeout=None):
+		"""
+		If coalesce, queued repeats of the key are merged into a single call
+		with the numeric parameters multiplied by the number of repeats. The timeout, in
+		milliseconds, limits the wait between the accelerators of a sequence
+		"""
 		self.accelerators = accelerators
 		self.function = function
-		self.parameters = parameters[0] if parameters else None
\ No newline at end of file
+		self.parameters = parameters[0] if parameters else None
+		self.coalesce = coalesce
+		self.timeout = timeout
+
+	def accumulated_parameters(self, repeats):
+		if repeats == 1 or not self.parameters:
+			return self.parameters
+		return [
+			p * repeats if isinstance(p, (int, float)) and not isinstance(p, bool) else p
+			for p in self.parameters]
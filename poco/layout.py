@@ -14,20 +14,41 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import gi, os
+import gi, os, functools, queue, threading, traceback
 import poco.state as state
+import poco.configurations as configurations
+from poco.names import counted
 gi.require_version('Wnck', '3.0')
 from gi.repository import Wnck, GLib, Gdk
-from poco.windows import monitor_work_area_for
+from poco.windows import MONITORS, identity_for
+from poco.rules import RULES
+from array import array
+from collections import namedtuple
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 
 class Monitor:
+	"""
+	Layout state of a monitor inside a workspace
+	"""
 
-	def __init__(self):
-		self.nmaster = 1
-		self.mfact = 0.5
+	def __init__(self, nmaster=1, mfact=0.5, function_key=None):
+		self.nmaster = nmaster
+		self.mfact = mfact
+		self.function_key = function_key
+		self.stack = Stack()
+		self.placement = {}
+		# bumped by every change to the stack or the layout, the placement is stale if it was planned before
+		self.revision = 0
+		self.planned_revision = None
 		self.wx = self.wy = self.ww = self.wh = None
 
+	def is_planned(self):
+		return self.planned_revision == self.revision
+
 	def set_workarea(self, x, y, width, height):
 		self.wx = x
 		self.wy = y
@@ -35,231 +56,884 @@ class Monitor:
 		self.wh = height
 
 
-def monocle(stack, monitor):
-	layout = []
-	for c in stack:
-		layout.append([monitor.wx, monitor.wy, monitor.ww, monitor.wh])
-	return layout
+class Stack:
+	"""
+	Ordered window xids, the first one is the master, kept in sync with a map from each xid to its position
+	"""
+
+	def __init__(self, xids=()):
+		self.xids = list(xids)
+		self.positions = {}
+		self._reindex(0, len(self.xids))
+
+	def _reindex(self, start, end):
+		for i in range(start, end):
+			self.positions[self.xids[i]] = i
+
+	def __contains__(self, xid):
+		return xid in self.positions
+
+	def __iter__(self):
+		return iter(self.xids)
+
+	def __len__(self):
+		return len(self.xids)
+
+	def __getitem__(self, index):
+		return self.xids[index]
+
+	def index(self, xid):
+		return self.positions[xid]
+
+	def insert(self, index, xid):
+		if xid in self.positions:
+			self.remove(xid)
+		self.xids.insert(index, xid)
+		self._reindex(min(index, len(self.xids) - 1), len(self.xids))
+
+	def remove(self, xid):
+		index = self.positions.pop(xid)
+		del self.xids[index]
+		self._reindex(index, len(self.xids))
+
+	def move(self, xid, new_index):
+		old_index = self.positions[xid]
+		self.xids.insert(new_index, self.xids.pop(old_index))
+		self._reindex(min(old_index, new_index), max(old_index, new_index) + 1)
+
+	def promote(self, xid):
+		self.move(xid, 0)
+
+	def sort(self, key):
+		self.xids.sort(key=key)
+		self._reindex(0, len(self.xids))
+
+	def copy(self):
+		return list(self.xids)
 
 
-def tile(stack, monitor):
-	layout = []
+#
+# Layout engine: the arrangements of dwm, computed for a stack size as columns
+# of x, y, width and height and converted to integer geometry in one step
+#
+def split(length, count):
+	"""
+	Offsets and sizes of count slices of length. Each size is computed from the remaining
+	length, as dwm does, so the truncated result matches dwm pixel by pixel
+	"""
+	offsets, sizes = [], []
+	offset = 0
+	for i in range(count):
+		size = (length - offset) / (count - i)
+		offsets.append(offset)
+		sizes.append(size)
+		offset += size
+	return offsets, sizes
 
-	if not stack:
-		return None
-	n = len(stack)
 
+def arrange_monocle(n, monitor):
+	return [monitor.wx] * n, [monitor.wy] * n, [monitor.ww] * n, [monitor.wh] * n
+
+
+def arrange_tile(n, monitor):
+	masters = min(n, monitor.nmaster)
 	if n > monitor.nmaster:
 		mw = monitor.ww * monitor.mfact if monitor.nmaster else 0
 	else:
 		mw = monitor.ww
-	my = ty = 0
-	for i in range(len(stack)):
-		if i < monitor.nmaster:
-			h = (monitor.wh - my) / (min(n, monitor.nmaster) - i);
-			layout.append([monitor.wx, monitor.wy + my, mw, h])
-			my += layout[-1][3]
-		else:
-			h = (monitor.wh - ty) / (n - i);
-			layout.append([monitor.wx + mw, monitor.wy + ty, monitor.ww - mw, h])
-			ty += layout[-1][3]
-
-	return layout
+	master_offsets, master_sizes = split(monitor.wh, masters)
+	stack_offsets, stack_sizes = split(monitor.wh, n - masters)
+	xs = [monitor.wx] * masters + [monitor.wx + mw] * (n - masters)
+	ys = [monitor.wy + o for o in master_offsets + stack_offsets]
+	ws = [mw] * masters + [monitor.ww - mw] * (n - masters)
+	return xs, ys, ws, master_sizes + stack_sizes
 
 
-def centeredmaster(stack, monitor):
-	if not stack:
-		return None
-
-	layout = []
+def arrange_centeredmaster(n, monitor):
+	masters = min(n, monitor.nmaster)
 	tw = mw = monitor.ww
-	mx = my = 0
-	oty = ety = 0
-	n = len(stack)
-
+	mx = 0
 	if n > monitor.nmaster:
 		mw = monitor.ww * monitor.mfact if monitor.nmaster else 0
 		tw = monitor.ww - mw
-
 		if n - monitor.nmaster > 1:
 			mx = (monitor.ww - mw) / 2
 			tw = (monitor.ww - mw) / 2
-
-	for i in range(len(stack)):
-		c = stack[i]
-		if i < monitor.nmaster:
-			# nmaster clients are stacked vertically, in the center of the screen
-			h = (monitor.wh - my) / (min(n, monitor.nmaster) - i)
-			layout.append([monitor.wx + mx, monitor.wy + my, mw, h])
-			my += h
+	master_offsets, master_sizes = split(monitor.wh, masters)
+	# stack clients alternate between the right (even) and the left (odd) columns
+	right_offsets, right_sizes = split(monitor.wh, (n - masters + 1) // 2)
+	left_offsets, left_sizes = split(monitor.wh, (n - masters) // 2)
+	xs, ys, ws, hs = [monitor.wx + mx] * masters, master_offsets, [mw] * masters, master_sizes
+	for s in range(n - masters):
+		if s % 2:
+			xs.append(monitor.wx)
+			ys.append(left_offsets[s // 2])
+			hs.append(left_sizes[s // 2])
 		else:
-			# stack clients are stacked vertically
-			if (i - monitor.nmaster) % 2:
-				h = (monitor.wh - ety) / int((1 + n - i) / 2)
-				layout.append([monitor.wx, monitor.wy + ety, tw, h])
-				ety += h
-			else:
-				h = (monitor.wh - oty) / int((1 + n - i) / 2)
-				layout.append([monitor.wx + mx + mw, monitor.wy + oty, tw, h])
-				oty += h
+			xs.append(monitor.wx + mx + mw)
+			ys.append(right_offsets[s // 2])
+			hs.append(right_sizes[s // 2])
+		ws.append(tw)
+	return xs, [monitor.wy + y for y in ys], ws, hs
+
+
+def arrange_grid(n, monitor):
+	"""
+	Columns of rows as dwm gaplessgrid, the last columns get one more row when n is not a square
+	"""
+	cols = 0
+	while cols <= n // 2 and cols * cols < n:
+		cols += 1
+	if n == 5:
+		cols = 2
+	rows = n // cols if cols else 0
+	cw = monitor.ww / cols if cols else monitor.ww
+	xs, ys, ws, hs = [], [], [], []
+	cn = rn = 0
+	for i in range(n):
+		if rows and i // rows + 1 > cols - n % cols:
+			rows = n // cols + 1
+		ch = monitor.wh / rows if rows else monitor.wh
+		xs.append(monitor.wx + cn * cw)
+		ys.append(monitor.wy + rn * ch)
+		ws.append(cw)
+		hs.append(ch)
+		rn += 1
+		if rn >= rows:
+			rn = 0
+			cn += 1
+	return xs, ys, ws, hs
+
+
+def arrange_bstack(n, monitor):
+	"""
+	Masters side by side on the top, the stack side by side below them
+	"""
+	masters = min(n, monitor.nmaster)
+	if n > monitor.nmaster:
+		mh = monitor.wh * monitor.mfact if monitor.nmaster else 0
+	else:
+		mh = monitor.wh
+	master_offsets, master_sizes = split(monitor.ww, masters)
+	stack_offsets, stack_sizes = split(monitor.ww, n - masters)
+	xs = [monitor.wx + o for o in master_offsets + stack_offsets]
+	ys = [monitor.wy] * masters + [monitor.wy + mh] * (n - masters)
+	hs = [mh] * masters + [monitor.wh - mh] * (n - masters)
+	return xs, ys, master_sizes + stack_sizes, hs
+
+
+def arrange_dwindle(n, monitor):
+	"""
+	Each window takes a half of the area left by the previous ones, alternating vertical and
+	horizontal splits. The first split follows mfact
+	"""
+	x, y, w, h = monitor.wx, monitor.wy, monitor.ww, monitor.wh
+	xs, ys, ws, hs = [], [], [], []
+	for i in range(n):
+		xs.append(x)
+		ys.append(y)
+		if i == n - 1:
+			ws.append(w)
+			hs.append(h)
+		elif i % 2:
+			ws.append(w)
+			hs.append(h / 2)
+			y += h / 2
+			h -= h / 2
+		else:
+			width = w * monitor.mfact if i == 0 else w / 2
+			ws.append(width)
+			hs.append(h)
+			x += width
+			w -= width
+	return xs, ys, ws, hs
+
+
+def arrange_deck(n, monitor):
+	"""
+	Masters as in tile, the stack windows on top of each other in the stack column
+	"""
+	masters = min(n, monitor.nmaster)
+	if n > monitor.nmaster:
+		mw = monitor.ww * monitor.mfact if monitor.nmaster else 0
+	else:
+		mw = monitor.ww
+	master_offsets, master_sizes = split(monitor.wh, masters)
+	xs = [monitor.wx] * masters + [monitor.wx + mw] * (n - masters)
+	ys = [monitor.wy + o for o in master_offsets] + [monitor.wy] * (n - masters)
+	ws = [mw] * masters + [monitor.ww - mw] * (n - masters)
+	return xs, ys, ws, master_sizes + [monitor.wh] * (n - masters)
+
+
+class LayoutFunction:
+	"""
+	A layout plugin. Its arrange function must be pure: from a stack size and the monitor
+	parameters it declares to the x, y, width and height columns of the windows, so every
+	result can be cached and tested without a screen
+	"""
+
+	def __init__(self, key, name, arrange, parameters=('nmaster', 'mfact'), complexity='O(n)', icon_key=None):
+		self.key = key
+		self.name = name
+		self.arrange = arrange
+		self.parameters = parameters
+		self.complexity = complexity
+		self.icon_key = icon_key or key
+
+
+LAYOUTS = {}
+ARRANGE_CACHE_SIZE = 256
+
+
+def register(layout_function):
+	LAYOUTS[layout_function.key] = layout_function
+	clear_arrangements()
+
+
+def arrange(function_key, n, monitor, gap=0):
+	"""
+	Returns the integer geometry, one x, y, width, height row per window, of a stack
+	of n windows, with the gap around each window. The result is shared, read only
+	"""
+	parameters = LAYOUTS[function_key].parameters
+	return _arrange(
+		function_key, n,
+		monitor.nmaster if 'nmaster' in parameters else None, monitor.mfact if 'mfact' in parameters else None,
+		monitor.wx, monitor.wy, monitor.ww, monitor.wh, gap)
+
+
+def plan(function_key, xids, monitor, gap=0):
+	"""
+	Maps each xid, in stack order, to the x, y, width, height tuple of its slot
+	"""
+	geometry = arrange(function_key, len(xids), monitor, gap=gap)
+	return {xid: tuple(map(int, geometry[i])) for i, xid in enumerate(xids)}
+
+
+def changed_slots(previous, current):
+	"""
+	Lists the xids of the current plan whose slot is new or differs from the previous plan
+	"""
+	return [xid for xid, rect in current.items() if previous.get(xid) != rect]
+
+
+@functools.lru_cache(maxsize=ARRANGE_CACHE_SIZE)
+def _arrange(function_key, n, nmaster, mfact, wx, wy, ww, wh, gap):
+	monitor = Monitor()
+	monitor.nmaster = nmaster
+	monitor.mfact = mfact
+	monitor.set_workarea(wx, wy, ww, wh)
+	geometry = to_geometry(*LAYOUTS[function_key].arrange(n, monitor), gap=gap)
+	if numpy:
+		geometry.flags.writeable = False
+		return geometry
+	return tuple(geometry)
+
+
+def clear_arrangements(*args):
+	_arrange.cache_clear()
+
+
+MONITORS.invalidate_callbacks.append(clear_arrangements)
+register(LayoutFunction('C', 'centeredmaster', arrange_centeredmaster))
+register(LayoutFunction('T', 'tile', arrange_tile))
+register(LayoutFunction('M', 'monocle', arrange_monocle, parameters=()))
+register(LayoutFunction('G', 'grid', arrange_grid, parameters=()))
+register(LayoutFunction('B', 'bstack', arrange_bstack))
+register(LayoutFunction('F', 'dwindle', arrange_dwindle, parameters=('mfact',)))
+register(LayoutFunction('D', 'deck', arrange_deck))
+
+
+def to_geometry(xs, ys, ws, hs, gap=0):
+	"""
+	Applies the gap and truncates the columns of coordinates into an N x 4 integer array,
+	a NumPy array if available, a list of array rows otherwise
+	"""
+	if numpy:
+		geometry = numpy.array([xs, ys, ws, hs], dtype=float).reshape(4, len(xs)).T
+		geometry += (gap, gap, -2 * gap, -2 * gap)
+		return geometry.astype(int)
+	return [
+		array('l', (int(x + gap), int(y + gap), int(w - 2 * gap), int(h - 2 * gap)))
+		for x, y, w, h in zip(xs, ys, ws, hs)]
+
+
+def match_saved_positions(identities, stack_state):
+	"""
+	Maps the xids, given with their identities in stack order, to their saved stack positions.
+	A window matches the entry of its own xid if the identity agrees, as after a restart, or
+	else the first unused entry of the same identity, through a hash index, as after a login
+	"""
+	positions = {}
+	used = set()
+	for xid, identity in identities.items():
+		entry = stack_state.get(str(xid))
+		if entry and ('identity' not in entry or tuple(entry['identity']) == identity):
+			positions[xid] = entry['stack_index']
+			used.add(str(xid))
+	by_identity = {}
+	for key, entry in sorted(stack_state.items(), key=lambda item: -item[1]['stack_index']):
+		if key not in used and 'identity' in entry:
+			by_identity.setdefault(tuple(entry['identity']), []).append(entry['stack_index'])
+	for xid, identity in identities.items():
+		if xid not in positions and by_identity.get(identity):
+			positions[xid] = by_identity[identity].pop()
+	return positions
+
+
+# snapshot of a monitor, taken inside the main loop, that a plan can be computed from in any thread
+PlanRequest = namedtuple(
+	'PlanRequest', 'key function_key xids nmaster mfact workarea gap previous requested active revision')
+
+
+def plan_monitor(request):
+	"""
+	Plans a monitor from its snapshot, without touching the screen. Returns the new placement
+	and the xids that may need to move, the other windows are known to be in their slots
+	"""
+	monitor = Monitor(request.nmaster, request.mfact, request.function_key)
+	monitor.set_workarea(*request.workarea)
+	placement = plan(request.function_key, request.xids, monitor, gap=request.gap)
+	changed = set(changed_slots(request.previous, placement))
+	candidates = [xid for xid in request.xids if xid in changed or request.requested.get(xid) != placement[xid]]
+	return placement, candidates
+
+
+class Planner:
+	"""
+	Computes the plans of the submitted snapshots in a worker thread and posts them back to
+	the main loop. A submission supersedes the plans still queued or computing, their results
+	are dropped
+	"""
+
+	def __init__(self, commit):
+		self.commit = commit
+		self.generation = self.done = 0
+		# counted by both the worker and the main loop
+		self.dropped = 0
+		self.dropped_lock = threading.Lock()
+		self.jobs = queue.Queue()
+		self.worker = None
+
+	def submit(self, requests):
+		self.generation += 1
+		self.jobs.put((self.generation, requests))
+		if not self.worker:
+			self.worker = threading.Thread(target=self._run, name='layout-planner', daemon=True)
+			self.worker.start()
+
+	def pending(self):
+		"""
+		If a submitted plan did not get back to the main loop yet
+		"""
+		return self.done != self.generation
+
+	def _run(self):
+		while True:
+			generation, requests = self.jobs.get()
+			try:
+				if generation == self.generation:
+					plans = [(request,) + plan_monitor(request) for request in requests]
+					GLib.idle_add(self._commit, generation, plans)
+				else:
+					self._drop()
+			except Exception:
+				traceback.print_exc()
+			finally:
+				self.jobs.task_done()
+
+	def _commit(self, generation, plans):
+		if generation == self.generation:
+			self.done = generation
+			self.commit(plans)
+		else:
+			self._drop()
+		return False
 
-	return layout
+	def _drop(self):
+		with self.dropped_lock:
+			self.dropped += 1
 
 
-FUNCTIONS_MAP = {'C': centeredmaster, 'T': tile, 'M': monocle}
-FUNCTIONS_NAME_MAP = {'C': 'centeredmaster', 'T': 'tile', 'M': 'monocle'}
+# milliseconds after a window is opened during which other opened windows are held, to be tiled together
+PLACEMENT_SETTLE_DELAY = 250
 
 
 # TODO: the the window is maximized, the layout function fails
 class Layout:
 
 	def __init__(self, windows):
-		self.function_key = None
-		self.window_monitor_map = {}
 		self.gap = 10
+		self.reconfigured = self.skipped = self.skipped_total = 0
+		self.scheduled_apply_id = None
+		self.settle_id = None
+		self.held_placements = False
+		self.planner = Planner(self._commit_plans)
 		self.windows = windows
-		self.monitor = Monitor()
+		# (workspace number, monitor number) to the monitor layout state
+		self.monitors = {}
+		self.active_key = None
+		# layout of the monitors created without an active one to copy it from
+		self.default_monitor = Monitor()
+		# xid to the key of the monitor where the window is stacked
+		self.window_keys = {}
+		# xid to the identity of the window, to restore the stacks after a login
+		self.identities = {}
+		# mutations are journaled once the state is restored
+		self.journaling = False
+		self.window_handlers = {}
+		# xids of the windows kept floating by a rule
+		self.floating = set()
 		self.windows.read_screen()
-		self.stack = filter(
-			lambda x: x in self.windows.visible, reversed(self.windows.screen.get_windows_stacked()))
-		self.stack = list(map(lambda x: x.get_xid(), self.stack))
+
+		for window in self.windows.screen.get_windows_stacked():
+			rule = RULES.match(window)
+			if rule and rule.floating:
+				self.floating.add(window.get_xid())
+				continue
+			self._install_window_handlers(window)
+			if self.windows.is_stackable(window):
+				self._stack(window)
 
 		try:
 			self.set_state(state.read_layout())
 		except KeyError as e:
 			print('can not load last state, there is a unknown key in the json')
 
-		self._install_state_handlers()
 		self.windows.screen.connect("window-opened", self._window_opened)
 		self.windows.screen.connect("window-closed", self._window_closed)
-		self.apply()
+		self.windows.screen.connect("active-workspace-changed", self._active_workspace_changed)
+		MONITORS.invalidate_callbacks.append(self._monitors_changed)
+		state.compact(self)
+		self.journaling = True
 
 	def set_state(self, json):
 		if not json:
 			return
-		self.monitor.nmaster = json['nmaster']
-		self.monitor.mfact = json['mfact']
-		self.function_key = json['function']
-		copy = self.stack.copy()
-		self.stack.sort(
-			key=lambda xid:
-			json['stack_state'][str(xid)]['stack_index']
-			if str(xid) in json['stack_state']
-			else copy.index(xid))
+		if 'monitors' in json:
+			for key_name, monitor_state in json['monitors'].items():
+				monitor = self._get_monitor(tuple(map(int, key_name.split(':'))))
+				monitor.nmaster = monitor_state['nmaster']
+				monitor.mfact = monitor_state['mfact']
+				monitor.function_key = monitor_state['function']
+		else:
+			for monitor in list(self.monitors.values()) + [self.default_monitor]:
+				monitor.nmaster = json['nmaster']
+				monitor.mfact = json['mfact']
+				monitor.function_key = json['function']
+		identities = {xid: self.identities[xid] for monitor in self.monitors.values() for xid in monitor.stack}
+		positions = match_saved_positions(identities, json['stack_state'])
+		for monitor in self.monitors.values():
+			monitor.stack.sort(key=lambda xid: positions[xid] if xid in positions else monitor.stack.index(xid))
 
 	#
 	# INTERNAL INTERFACE
 	#
-	def _install_state_handlers(self):
-		for window in self.windows.buffers:
-			if window.get_xid() not in self.window_monitor_map:
-				handler_id = window.connect("state-changed", self._state_changed)
-				self.window_monitor_map[window.get_xid()] = handler_id
-
-	def _incremented_index(self, increment):
-		old_index = self.stack.index(self.windows.active.xid)
+	def _install_window_handlers(self, window):
+		if window.get_xid() not in self.window_handlers:
+			self.window_handlers[window.get_xid()] = [
+				window.connect("state-changed", self._state_changed),
+				window.connect("workspace-changed", self._window_moved),
+				window.connect("geometry-changed", self._window_geometry_changed)]
+
+	def _get_monitor(self, key):
+		if key not in self.monitors:
+			# new monitors start with the layout of the active one
+			template = self.monitors.get(self.active_key, self.default_monitor)
+			self.monitors[key] = Monitor(template.nmaster, template.mfact, template.function_key)
+			self._record_monitor(key)
+		return self.monitors[key]
+
+	def _key_for(self, window):
+		workspace = window.get_workspace()
+		workspace_number = workspace.get_number() if workspace else self._active_workspace_number()
+		if workspace_number is None:
+			# a pinned window while there is no active workspace stays where it is
+			workspace_number = (self.window_keys.get(window.get_xid()) or self.active_key or (0, 0))[0]
+		return workspace_number, MONITORS.monitor_for(window)
+
+	def _active_workspace_number(self):
+		"""
+		None while there is no active workspace, as during a workspace teardown or on some window managers
+		"""
+		workspace = self.windows.screen.get_active_workspace()
+		return workspace.get_number() if workspace else None
+
+	def _stack(self, window, key=None):
+		self._unstack(window.get_xid())
+		key = key or self._key_for(window)
+		if window.get_xid() not in self.identities:
+			self.identities[window.get_xid()] = identity_for(window)
+		self._get_monitor(key).stack.insert(0, window.get_xid())
+		self.window_keys[window.get_xid()] = key
+		self._record_insert(key, window.get_xid(), 0)
+
+	def _unstack(self, xid):
+		key = self.window_keys.pop(xid, None)
+		if key:
+			self.monitors[key].stack.remove(xid)
+			self._record(state.REMOVE, key, xid)
+
+	def _record(self, operation, key, xid, index=0):
+		self.monitors[key].revision += 1
+		if self.journaling:
+			state.record(self, operation, key, xid=xid, value=index)
+
+	def _record_insert(self, key, xid, index):
+		"""
+		Journals the insert followed by the identity of the window, the snapshot may have been taken without it
+		"""
+		self.monitors[key].revision += 1
+		if self.journaling:
+			state.record(self, state.INSERT, key, xid=xid, value=index)
+			state.record(self, state.IDENTITY, key, xid=xid, identity=self.identities[xid])
+
+	def _record_monitor(self, key):
+		self.monitors[key].revision += 1
+		if self.journaling:
+			monitor = self.monitors[key]
+			state.record(
+				self, state.MONITOR, key, function=ord(monitor.function_key) if monitor.function_key else 0,
+				xid=monitor.nmaster, value=monitor.mfact)
+
+	def _schedule_apply(self):
+		"""
+		Coalesces bursts of window events into a single apply
+		"""
+		if self.scheduled_apply_id:
+			return
+		delay = configurations.get_relayout_delay()
+		if delay:
+			self.scheduled_apply_id = GLib.timeout_add(delay, self._scheduled_apply)
+		else:
+			self.scheduled_apply_id = GLib.idle_add(self._scheduled_apply)
+
+	def _scheduled_apply(self):
+		self.scheduled_apply_id = None
+		self.apply()
+		return False
+
+	def _update_workarea(self, monitor, monitor_number):
+		"""
+		Returns False, leaving the monitor as is, if there is no such monitor anymore
+		"""
+		wa = MONITORS.workarea(monitor_number)
+		if not wa:
+			return False
+		monitor.set_workarea(
+			x=wa.x + self.gap, y=wa.y + self.gap, width=wa.width - self.gap * 2, height=wa.height - self.gap * 2)
+		return True
+
+	def _fold_stale_monitors(self):
+		"""
+		Moves the windows stacked on monitors that are gone to the end of the stack of the first
+		monitor of their workspace. The layout of the stale monitors is kept for when they come back
+		"""
+		count = MONITORS.count()
+		for key in [key for key in self.monitors if key[1] >= count]:
+			folded_key = (key[0], 0)
+			folded_stack = self._get_monitor(folded_key).stack
+			for xid in self.monitors[key].stack.copy():
+				self._unstack(xid)
+				folded_stack.insert(len(folded_stack), xid)
+				self.window_keys[xid] = folded_key
+				self._record_insert(folded_key, xid, len(folded_stack) - 1)
+
+	def _incremented_index(self, stack, increment):
+		old_index = stack.index(self.windows.active.xid)
 		new_index = old_index + increment
-		return min(max(new_index, 0), len(self.stack) - 1)
+		return min(max(new_index, 0), len(stack) - 1)
 
 	#
 	# PUBLIC INTERFACE
 	#
+	def get_active_monitor(self):
+		"""
+		Returns the layout state of the monitor of the active window, or of the first
+		monitor of the active workspace if there is no active window
+		"""
+		active_window = self.windows.active.get_wnck_window()
+		active_workspace_number = self._active_workspace_number()
+		if active_window:
+			key = self.window_keys.get(active_window.get_xid()) or self._key_for(active_window)
+		elif active_workspace_number is not None:
+			key = (active_workspace_number, 0)
+		else:
+			key = self.active_key or (0, 0)
+		monitor = self._get_monitor(key)
+		self.active_key = key
+		return monitor
+
+	def apply_rules(self):
+		"""
+		Takes out of the stacks the windows that a rule, loaded after they were stacked, keeps floating,
+		and stacks back the windows no rule keeps floating anymore. Covers the windows of every workspace
+		"""
+		changed = False
+		for window in self.windows.screen.get_windows():
+			xid = window.get_xid()
+			rule = RULES.match(window)
+			if rule and rule.floating and xid not in self.floating:
+				self.floating.add(xid)
+				for handler_id in self.window_handlers.pop(xid, []):
+					window.disconnect(handler_id)
+				if xid in self.window_keys:
+					self._unstack(xid)
+					changed = True
+			elif not (rule and rule.floating) and xid in self.floating:
+				self.floating.discard(xid)
+				self._install_window_handlers(window)
+				if self.windows.is_stackable(window):
+					self._stack(window)
+					changed = True
+		if changed:
+			self._schedule_apply()
+
 	def set_function(self, function_key):
-		self.function_key = function_key
-		self.windows.read_screen()
+		self.windows.refresh()
+		self.get_active_monitor().function_key = function_key
+		self._record_monitor(self.active_key)
 		self.apply()
 
 	#
 	# CALLBACKS
 	#
 	def _window_closed(self, screen, window):
-		if window.get_xid() in self.stack:
-			self.stack.remove(window.get_xid())
-		if self.windows.is_visible(window):
-			self.windows.read_screen(force_update=False)
-			self.apply()
+		self.window_handlers.pop(window.get_xid(), None)
+		self.floating.discard(window.get_xid())
+		self.identities.pop(window.get_xid(), None)
+		if window.get_xid() in self.window_keys:
+			self._unstack(window.get_xid())
+			self._schedule_apply()
 
 	def _window_opened(self, screen, window):
-		if self.windows.is_visible(window):
-			self.stack.insert(0, window.get_xid())
-			self.windows.read_screen(force_update=False)
-			self.windows.apply_decoration_config()
-			self.apply()
+		rule = RULES.match(window)
+		if rule and rule.floating:
+			self.floating.add(window.get_xid())
+			return
+		self._install_window_handlers(window)
+		if not self.windows.is_stackable(window):
+			return
+		if rule and rule.workspace and rule.workspace <= screen.get_workspace_count():
+			workspace = screen.get_workspace(rule.workspace - 1)
+			window.move_to_workspace(workspace)
+			self._stack(window, key=(workspace.get_number(), MONITORS.monitor_for(window)))
+		else:
+			self._stack(window)
+		self.windows.apply_decoration_config_to(window)
+		self._place(window)
 
 	def _state_changed(self, window, changed_mask, new_state):
 		if changed_mask & Wnck.WindowState.MINIMIZED:
-			if self.windows.is_visible(window):
-				self.stack.insert(0, window.get_xid())
+			if self.windows.is_stackable(window):
+				self._stack(window)
 			else:
-				self.stack.remove(window.get_xid())
-			self.windows.read_screen(force_update=False)
-			self.apply()
+				self._unstack(window.get_xid())
+			self._schedule_apply()
+
+	def _window_geometry_changed(self, window):
+		"""
+		Skips the monitor lookup if the window is where poco asked it to be, on the monitor it was planned for
+		"""
+		if self.windows.confirmed_request(window.get_xid()) is None:
+			self._window_moved(window)
+
+	def _window_moved(self, window):
+		"""
+		Moves the window to the stack of its new workspace or monitor, if changed
+		"""
+		xid = window.get_xid()
+		if xid in self.window_keys and self.window_keys[xid] != self._key_for(window):
+			self._stack(window)
+			self._schedule_apply()
+
+	def _monitors_changed(self):
+		self._fold_stale_monitors()
+		for monitor in self.monitors.values():
+			monitor.revision += 1
+		self._schedule_apply()
+
+	def _active_workspace_changed(self, screen, previously_active_space):
+		"""
+		Arranges the monitors of the new workspace at once from their last placement, only the
+		monitors whose stack or layout changed since are planned again
+		"""
+		for window in self.windows.visible:
+			if window.is_pinned():
+				self._window_moved(window)
+		active_workspace_number = self._active_workspace_number()
+		plans = []
+		for key, monitor in self.monitors.items():
+			if key[0] != active_workspace_number or not monitor.is_planned():
+				continue
+			request = self._plan_request(key, monitor, True)
+			if set(request.xids) != set(monitor.placement):
+				# planned with windows that are not visible, or without visible ones
+				monitor.revision += 1
+				continue
+			candidates = [xid for xid in request.xids if request.requested.get(xid) != monitor.placement[xid]]
+			plans.append((request, monitor.placement, candidates))
+		self._commit_plans(plans)
+		self.apply(changed_only=True)
 
 	#
 	# COMMANDS
 	#
+	@counted
 	def swap_focused_with(self, c_in):
-		if self.windows.active.xid:
-			direction = c_in.parameters[0]
-			old_index = self.stack.index(self.windows.active.xid)
-			new_index = self._incremented_index(direction)
+		stack = self.get_active_monitor().stack
+		if self.windows.active.xid in stack:
+			direction = c_in.parameters[0] * c_in.count
+			old_index = stack.index(self.windows.active.xid)
+			new_index = self._incremented_index(stack, direction)
 			if new_index != old_index:
-				self.stack.insert(new_index, self.stack.pop(old_index))
+				stack.move(self.windows.active.xid, new_index)
+				self._record(state.MOVE, self.active_key, self.windows.active.xid, new_index)
 				self.apply()
 
+	@counted
 	def move_focus(self, c_in):
-		if self.windows.active.xid:
-			direction = c_in.parameters[0]
-			new_index = self._incremented_index(direction)
-			self.windows.active.change_to(self.stack[new_index])
+		stack = self.get_active_monitor().stack
+		if self.windows.active.xid in stack:
+			direction = c_in.parameters[0] * c_in.count
+			new_index = self._incremented_index(stack, direction)
+			self.windows.active.change_to(stack[new_index])
 
 	def change_function(self, c_in):
 		function_key = c_in.parameters[0]
 		self.set_function(function_key)
 
 	def move_to_master(self, c_in):
-		if self.windows.active.xid:
-			old_index = self.stack.index(self.windows.active.xid)
-			self.stack.insert(0, self.stack.pop(old_index))
+		stack = self.get_active_monitor().stack
+		if self.windows.active.xid in stack:
+			stack.promote(self.windows.active.xid)
+			self._record(state.MOVE, self.active_key, self.windows.active.xid, 0)
 			self.apply()
 
+	@counted
 	def increase_master_area(self, c_in):
-		increment = c_in.parameters[0]
-		self.monitor.mfact += increment
-		self.monitor.mfact = max(0.1, self.monitor.mfact)
-		self.monitor.mfact = min(0.9, self.monitor.mfact)
+		monitor = self.get_active_monitor()
+		increment = c_in.parameters[0] * c_in.count
+		monitor.mfact += increment
+		monitor.mfact = max(0.1, monitor.mfact)
+		monitor.mfact = min(0.9, monitor.mfact)
+		self._record_monitor(self.active_key)
 		self.apply()
 
+	@counted
 	def increment_master(self, c_in):
-		increment = c_in.parameters[0]
-		self.monitor.nmaster += increment
-		self.monitor.nmaster = max(0, self.monitor.nmaster)
-		self.monitor.nmaster = min(len(self.stack), self.monitor.nmaster)
+		monitor = self.get_active_monitor()
+		increment = c_in.parameters[0] * c_in.count
+		monitor.nmaster += increment
+		monitor.nmaster = max(0, monitor.nmaster)
+		monitor.nmaster = min(len(monitor.stack), monitor.nmaster)
+		self._record_monitor(self.active_key)
 		self.apply()
 
-	def apply(self):
-		state.write(self)
-		self._install_state_handlers()
-
-		if not self.function_key:
+	def apply(self, changed_only=False):
+		"""
+		Plans in the worker thread the monitors of the active workspace, unless changed_only, and
+		the monitors whose stack or layout changed since their last plan, flushing any scheduled
+		apply. The windows of the active workspace are arranged once the plan gets back to the
+		main loop, the placements of the other workspaces are kept for when they become active
+		"""
+		if self.scheduled_apply_id:
+			GLib.source_remove(self.scheduled_apply_id)
+			self.scheduled_apply_id = None
+		self.held_placements = False
+
+		active_workspace_number = self._active_workspace_number()
+		requests = []
+		for key, monitor in self.monitors.items():
+			workspace_number, monitor_number = key
+			active = workspace_number == active_workspace_number
+			if monitor.function_key not in LAYOUTS or not monitor.stack:
+				continue
+			if monitor.is_planned() and (changed_only or not active):
+				continue
+			if not self._update_workarea(monitor, monitor_number):
+				continue
+			requests.append(self._plan_request(key, monitor, active))
+		self.planner.submit(requests)
+
+	def _plan_request(self, key, monitor, active):
+		if active:
+			xids = [xid for xid in monitor.stack if xid in self.windows.visible_map]
+		else:
+			xids = list(monitor.stack)
+		confirmed = {xid: self.windows.confirmed_request(xid) for xid in xids}
+		return PlanRequest(
+			key=key, function_key=monitor.function_key, xids=tuple(xids), nmaster=monitor.nmaster,
+			mfact=monitor.mfact, workarea=(monitor.wx, monitor.wy, monitor.ww, monitor.wh), gap=self.gap,
+			previous=dict(monitor.placement), requested={xid: r for xid, r in confirmed.items() if r is not None},
+			active=active, revision=monitor.revision)
+
+	def _commit_plans(self, plans):
+		"""
+		Keeps the placement of every planned monitor, and sends geometry only to the windows of
+		the active ones whose slot changed since the last plan, or that were moved away from it since
+		"""
+		self.reconfigured = self.skipped = 0
+		transaction = self.windows.transaction()
+		for request, placement, candidates in plans:
+			monitor = self.monitors.get(request.key)
+			if not monitor:
+				continue
+			monitor.placement = placement
+			monitor.planned_revision = request.revision
+			if not request.active:
+				continue
+			self.skipped += len(placement) - len(candidates)
+			for xid in candidates:
+				w = self.windows.visible_map.get(xid)
+				if not w:
+					continue
+				x, y, width, height = placement[xid]
+				if self.windows.is_arranged(w, x, y, width, height):
+					self.skipped += 1
+					continue
+				self.windows.set_geometry(w, x=x, y=y, w=width, h=height, transaction=transaction)
+				self.reconfigured += 1
+		transaction.commit()
+		self.skipped_total += self.skipped
+
+	def _place(self, window):
+		"""
+		Tiles a just opened window, and the windows whose slots it changes, right away if the layout
+		is settled: no apply scheduled or planning, and no other window opened in the last
+		PLACEMENT_SETTLE_DELAY. Windows opened in a burst, as on a session restore, wait for it to
+		end and are tiled together by a single apply
+		"""
+		burst = self.settle_id or self.scheduled_apply_id or self.planner.pending()
+		if self.settle_id:
+			GLib.source_remove(self.settle_id)
+		self.settle_id = GLib.timeout_add(PLACEMENT_SETTLE_DELAY, self._settled)
+		if burst:
+			self.held_placements = True
 			return
-
-		w_stack = list(filter(
-			lambda x: x is not None,
-			map(lambda xid: self.windows.visible_map[xid] if xid in self.windows.visible_map else None, self.stack)))
-
-		if not w_stack:
+		key = self.window_keys[window.get_xid()]
+		monitor = self.monitors[key]
+		if key[0] != self._active_workspace_number() or monitor.function_key not in LAYOUTS:
+			self._schedule_apply()
 			return
-
-		wa = monitor_work_area_for(w_stack[0])
-
-		self.monitor.set_workarea(
-			x=wa.x + self.gap, y=wa.y + self.gap, width=wa.width - self.gap * 2, height=wa.height - self.gap * 2)
-
-		arrange = FUNCTIONS_MAP[self.function_key](w_stack, self.monitor)
-
-		for i in range(len(arrange)):
-			a = arrange[i]
-			w = w_stack[i]
-			self.windows.set_geometry(
-				w, x=a[0] + self.gap, y=a[1] + self.gap, w=a[2] - self.gap * 2, h=a[3] - self.gap * 2)
+		if not self._update_workarea(monitor, key[1]):
+			self._schedule_apply()
+			return
+		request = self._plan_request(key, monitor, True)
+		self._commit_plans([(request,) + plan_monitor(request)])
+
+	def _settled(self):
+		self.settle_id = None
+		if self.held_placements:
+			self.held_placements = False
+			self._schedule_apply()
+		return False
+
+	def get_metadata_resume(self):
+		cache_info = _arrange.cache_info()
+		resume = 'layout: last apply reconfigured {}, skipped {} ({} skipped in total)\n'.format(
+			self.reconfigured, self.skipped, self.skipped_total)
+		resume += 'arrangements: {} cached, {} hits, {} misses, {} stale plans dropped\n'.format(
+			cache_info.currsize, cache_info.hits, cache_info.misses, self.planner.dropped)
+		resume += 'state: {} snapshots, {} journal records\n'.format(state.JOURNAL.snapshots, state.JOURNAL.records)
+		return resume
@@ -1,5 +1,6 @@
 from poco.keyboard import Key
 from poco.names import Name
+from poco.rules import Rule
 import poco
 
 applications = poco.applications
@@ -19,11 +20,15 @@ keys = [
 	Key(['<Ctrl>d'], layout.increment_master, [-1]),
 	Key(['<Ctrl>j'], layout.move_focus, [1]),
 	Key(['<Ctrl>k'], layout.move_focus, [-1]),
-	Key(['<Ctrl>l'], layout.increase_master_area, [0.05]),
-	Key(['<Ctrl>h'], layout.increase_master_area, [-0.05]),
+	Key(['<Ctrl>l'], layout.increase_master_area, [0.05], coalesce=True),
+	Key(['<Ctrl>h'], layout.increase_master_area, [-0.05], coalesce=True),
 	Key(['<Ctrl>u'], layout.change_function, ['C']),
 	Key(['<Ctrl>t'], layout.change_function, ['T']),
 	Key(['<Ctrl>m'], layout.change_function, ['M']),
+	Key(['<Ctrl><Shift>g'], layout.change_function, ['G']),
+	Key(['<Ctrl><Shift>b'], layout.change_function, ['B']),
+	Key(['<Ctrl><Shift>f'], layout.change_function, ['F']),
+	Key(['<Ctrl><Shift>d'], layout.change_function, ['D']),
 	Key(['<Ctrl>f'], layout.change_function, [None]),
 
 	# xmonad bindings https://xmonad.org/manpage.html
@@ -72,3 +77,7 @@ names = [
 	Name('quit', 'q', windows.active.minimize),
 	Name('only', 'on', windows.active.only),
 ]
+rules = [
+	Rule(window_type='dialog', floating=True),
+	Rule(window_type='splashscreen', floating=True),
+]
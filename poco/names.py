@@ -29,6 +29,19 @@ def add(name):
 	ALIAS_MAP[name.alias] = name
 
 
+def counted(function):
+	"""
+	Marks a command able to handle a count (PromptInput.count) in a single call,
+	instead of being called count times
+	"""
+	function.counted = True
+	return function
+
+
+def is_counted(function):
+	return getattr(function, 'counted', False)
+
+
 def completions_for(user_input):
 	filtered = filter(lambda n: n.startswith(user_input) if user_input else True, NAME_MAP.keys())
 	return sorted(list(set(filtered)))
@@ -61,11 +74,12 @@ class Name:
 
 class PromptInput:
 
-	def __init__(self, time=None, text=None, keyval=None, parameters=None):
+	def __init__(self, time=None, text=None, keyval=None, parameters=None, count=1):
 		self.time = time
 		self.text = text
 		self.keyval = keyval
 		self.parameters = parameters
+		self.count = count
 		self.colon_spacer = ''
 		self.vim_command = ''
 		self.vim_command_spacer = ''
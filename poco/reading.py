@@ -182,7 +182,7 @@ class Reading:
 
 	# TODO: remove from here
 	def execute(self, cmd):
-		self.windows.read_screen()
+		self.windows.refresh()
 		c_in = PromptInput(time=None, text=cmd).parse()
 		name = names.match(c_in)
 		name.function(c_in)
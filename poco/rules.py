@@ -0,0 +1,110 @@
+"""
+Copyright 2017 Pedro Santos
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import re
+import poco.configurations as configurations
+
+
+class Rule:
+	"""
+	Matches new windows on WM_CLASS, role, type hint and title, and tells the layout what to do with them:
+	keep them floating, out of the stack, or send them to a workspace, numbered from 1
+	"""
+
+	def __init__(self, wm_class=None, role=None, window_type=None, title=None, floating=False, workspace=None):
+		self.wm_class = wm_class.lower() if wm_class else None
+		self.role = role
+		self.window_type = window_type.lower() if window_type else None
+		self.title = re.compile(title) if title else None
+		self.floating = floating
+		self.workspace = workspace
+
+	def matches(self, window):
+		if self.role is not None and window.get_role() != self.role:
+			return False
+		if self.window_type is not None and window.get_window_type().value_nick != self.window_type:
+			return False
+		if self.title is not None and not self.title.search(window.get_name() or ''):
+			return False
+		return True
+
+
+class Rules:
+	"""
+	Rules indexed by WM_CLASS, a window is only tested against the rules of its class group and instance
+	names and the class independent ones, in the order they were declared. The first matching rule wins
+	"""
+
+	def __init__(self):
+		self.rules = []
+		self.by_class = {}
+		self.any_class = []
+
+	def load(self, rules):
+		self.rules = list(rules)
+		self.any_class = [r for r in self.rules if not r.wm_class]
+		self.by_class = {}
+		for r in self.rules:
+			if r.wm_class and r.wm_class not in self.by_class:
+				self.by_class[r.wm_class] = [
+					c for c in self.rules if c.wm_class == r.wm_class or not c.wm_class]
+
+	def match(self, window):
+		if not self.rules:
+			return None
+		candidates = self.any_class
+		if self.by_class:
+			class_names = {
+				n.lower() for n in (window.get_class_group_name(), window.get_class_instance_name())
+				if n and n.lower() in self.by_class}
+			if len(class_names) == 1:
+				candidates = self.by_class[class_names.pop()]
+			elif class_names:
+				# rules of both the class group and instance, still in declaration order
+				candidates = [r for r in self.rules if not r.wm_class or r.wm_class in class_names]
+		return next((r for r in candidates if r.matches(window)), None)
+
+
+def from_configurations():
+	rules = []
+	for options in configurations.get_rules():
+		try:
+			rules.append(Rule(
+				wm_class=options.get('class'), role=options.get('role'), window_type=options.get('type'),
+				title=options.get('title'), floating=options.get('float', 'false').lower() == 'true',
+				workspace=workspace_option(options)))
+		except re.error as e:
+			print('ignoring rule with title {}, not a valid pattern: {}'.format(options['title'], e))
+	return rules
+
+
+def workspace_option(options):
+	"""
+	The workspace number of the rule options, None, ignoring the option, if it is not a number from 1
+	"""
+	if not options.get('workspace'):
+		return None
+	try:
+		workspace = int(options['workspace'])
+	except ValueError:
+		workspace = 0
+	if workspace < 1:
+		print('ignoring rule workspace {}, workspaces are numbered from 1'.format(options['workspace']))
+		return None
+	return workspace
+
+
+RULES = Rules()
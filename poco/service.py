@@ -22,12 +22,14 @@ x11.XInitThreads()
 # add python lock to Xlib internals
 from Xlib import threaded
 
-import os, gi, signal, setproctitle, logging, traceback
+import os, gi, signal, setproctitle, logging, traceback, threading
 import poco.names as names
 import poco.configurations as configurations
 import poco.applications as applications
 import poco.messages as messages
 import poco.terminal as terminal
+import poco.rules as rules
+import poco.state as state
 
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gdk', '3.0')
@@ -45,9 +47,14 @@ SIGTERM = getattr(signal, "SIGTERM", None)
 SIGHUP = getattr(signal, "SIGHUP", None)
 
 mappings = listener = bus_object = status_icon = None
+# keys waiting for the main loop, appended by the keyboard listener thread
+pending_keys = []
+pending_keys_lock = threading.Lock()
 windows = Windows(configurations.is_list_workspaces())
 GObject.threads_init()
 reading = Reading(configurations=configurations, windows=windows)
+# the rules of the mappings module need the layout, those of the configuration file are known before it
+rules.RULES.load(rules.from_configurations())
 layout = Layout(reading.windows,)
 
 
@@ -63,6 +70,9 @@ def start():
 	listener = KeyboardListener(callback=keyboard_listener, on_error=stop)
 
 	load_mappings()
+	load_rules()
+	# the first arrangement waits for every rule, so no floating window is ever tiled
+	layout.apply()
 
 	for name in mappings.names:
 		names.add(name)
@@ -99,15 +109,27 @@ def load_mappings():
 		mappings = default_mappings
 
 
+def load_rules():
+	rules.RULES.load(rules.from_configurations() + list(getattr(mappings, 'rules', [])))
+	layout.apply_rules()
+
+
 def keyboard_listener(key, x_key_event, multiplier=1):
-	GLib.idle_add(
-		_inside_main_loop, key, x_key_event, multiplier,
-		priority=GLib.PRIORITY_HIGH)
+	with pending_keys_lock:
+		if key.coalesce and pending_keys and pending_keys[-1][0] is key and pending_keys[-1][2] == multiplier:
+			pending_keys[-1][1] = x_key_event
+			pending_keys[-1][3] += 1
+			return
+		pending_keys.append([key, x_key_event, multiplier, 1])
+	GLib.idle_add(_inside_main_loop, priority=GLib.PRIORITY_HIGH)
 
 
-def _inside_main_loop(key, x_key_event, multiplier):
+def _inside_main_loop():
+	with pending_keys_lock:
+		key, x_key_event, multiplier, repeats = pending_keys.pop(0)
+
 	command_input = PromptInput(
-		time=x_key_event.time, keyval=x_key_event.keyval, parameters=key.parameters)
+		time=x_key_event.time, keyval=x_key_event.keyval, parameters=key.accumulated_parameters(repeats))
 
 	execute(key.function, command_input, multiplier)
 
@@ -117,9 +139,15 @@ def _inside_main_loop(key, x_key_event, multiplier):
 def execute(function, command_input, multiplier=1):
 	try:
 		reading.clean_state()
-		windows.read_screen()
+		windows.refresh()
+
+		if names.is_counted(function):
+			command_input.count = multiplier
+			calls = 1
+		else:
+			calls = multiplier
 
-		for i in range(multiplier):
+		for i in range(calls):
 			return_message = function(command_input)
 			if return_message:
 				messages.add_message(return_message)
@@ -156,6 +184,7 @@ def configure_process():
 
 def reload(c_in):
 	configurations.reload()
+	load_rules()
 	status_icon.reload()
 	applications.reload()
 	terminal.reload()
@@ -164,7 +193,7 @@ def reload(c_in):
 
 
 def debug(c_in):
-	return messages.Message(windows.get_metadata_resume(), None)
+	return messages.Message(layout.get_metadata_resume() + windows.get_metadata_resume(), None)
 
 
 def install_glib_handler(sig):
@@ -195,11 +224,21 @@ def release_bus_object():
 
 
 def stop():
-	GLib.idle_add(Gtk.main_quit, priority=GLib.PRIORITY_HIGH)
+	"""
+	Also called by the keyboard listener thread on errors, the state is saved inside the main loop
+	"""
+	GLib.idle_add(_save_state_and_quit, priority=GLib.PRIORITY_HIGH)
 	listener.stop()
 	release_bus_object()
 
 
+def _save_state_and_quit():
+	state.compact(layout)
+	state.flush()
+	Gtk.main_quit()
+	return False
+
+
 def show_warning(error):
 	error_dialog = Gtk.MessageDialog(
 		None, Gtk.DialogFlags.MODAL, Gtk.MessageType.WARNING,
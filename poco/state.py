@@ -14,32 +14,226 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import os, json
+import os, json, struct, time
+from gi.repository import GLib
 layout_file = '/tmp/poco_layout.json'
+journal_file = '/tmp/poco_layout.journal'
 decorations_file = '/tmp/poco_decoration.json'
+# milliseconds between two writes of the same state file
+FLUSH_DELAY = 1000
+# journal records that trigger a new snapshot
+COMPACT_RECORDS = 4096
 
+# journal operations
+MONITOR, INSERT, REMOVE, MOVE, IDENTITY = range(1, 6)
+JOURNAL_MAGIC = b'POC2'
+# magic, sequence of the snapshot the records apply to
+JOURNAL_HEADER = struct.Struct('<4sI')
+# time, operation, workspace, monitor, function key, xid or nmaster, stack index or mfact or payload size.
+# An IDENTITY record is followed by its payload, the window identity as a JSON list
+JOURNAL_RECORD = struct.Struct('<IBHHBId')
 
-def write(layout):
-	with open(layout_file, 'w') as f:
-		json.dump(to_json(layout), f, indent=True)
+
+class WriteBehind:
+	"""
+	Keeps the last state marked as dirty and snapshots it at most once per FLUSH_DELAY,
+	or when flushed at shutdown. The file is only replaced, atomically, if the serialized
+	snapshot differs from the last written one
+	"""
+
+	def __init__(self, path, snapshot, serialize, delay=FLUSH_DELAY):
+		self.path = path
+		self.snapshot = snapshot
+		self.serialize = serialize
+		self.delay = delay
+		self.dirty = None
+		self.flush_id = None
+		self.content = None
+		self.writes = self.skipped = 0
+
+	def mark(self, source):
+		self.dirty = source
+		if not self.flush_id:
+			self.flush_id = GLib.timeout_add(self.delay, self._timed_flush)
+
+	def _timed_flush(self):
+		self.flush_id = None
+		self.flush()
+		return False
+
+	def flush(self):
+		if self.flush_id:
+			GLib.source_remove(self.flush_id)
+			self.flush_id = None
+		if self.dirty is None:
+			return
+		content = self.serialize(self.snapshot(self.dirty))
+		self.dirty = None
+		if content == self.content:
+			self.skipped += 1
+			return
+		write_atomically(self.path, content)
+		self.content = content
+		self.writes += 1
+
+
+class Journal:
+	"""
+	Append only log, in fixed size binary records, of the layout mutations made after the
+	last snapshot. A journal whose header does not match the snapshot sequence is stale and
+	ignored, as is a record torn by a crash
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.sequence = 0
+		self.records = 0
+		self.snapshots = 0
+		self.file = None
+
+	def read(self, sequence):
+		self.sequence = sequence
+		try:
+			with open(self.path, 'rb') as f:
+				data = f.read()
+		except FileNotFoundError:
+			return []
+		if len(data) < JOURNAL_HEADER.size or JOURNAL_HEADER.unpack_from(data) != (JOURNAL_MAGIC, sequence):
+			return []
+		records = []
+		offset = JOURNAL_HEADER.size
+		while offset + JOURNAL_RECORD.size <= len(data):
+			record = JOURNAL_RECORD.unpack_from(data, offset)
+			offset += JOURNAL_RECORD.size
+			if record[1] == IDENTITY:
+				size = int(record[6])
+				if offset + size > len(data):
+					break
+				# the identity takes the place of the payload size
+				record = record[:6] + (tuple(json.loads(data[offset:offset + size].decode())),)
+				offset += size
+			records.append(record)
+		return records
+
+	def append(self, operation, key, function=0, xid=0, value=0, payload=b''):
+		if not self.file:
+			self.reset()
+		workspace_number, monitor_number = key
+		if payload:
+			value = len(payload)
+		self.file.write(JOURNAL_RECORD.pack(
+			int(time.time()), operation, workspace_number, monitor_number, function, xid, value) + payload)
+		self.records += 1
+
+	def reset(self):
+		"""
+		Replaces the journal with an empty one for the current sequence
+		"""
+		if self.file:
+			self.file.close()
+		temporary_path = '{}.{}.tmp'.format(self.path, os.getpid())
+		with open(temporary_path, 'wb') as f:
+			f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, self.sequence))
+		os.replace(temporary_path, self.path)
+		self.file = open(self.path, 'ab', buffering=0)
+		self.records = 0
+
+
+def replay(snapshot, records):
+	"""
+	Applies the journal records to a layout snapshot. The entry of a window removed and inserted
+	back, as when moved to another monitor, keeps its name and identity
+	"""
+	monitors_state = snapshot.setdefault('monitors', {})
+	stack_state = snapshot.setdefault('stack_state', {})
+	homes = {}
+	stacks = {}
+	identities = {}
+	removed = set()
+	for key, entry in sorted(stack_state.items(), key=lambda item: item[1]['stack_index']):
+		if 'monitor' in entry:
+			homes[int(key)] = entry['monitor']
+			stacks.setdefault(entry['monitor'], []).append(int(key))
+	for _, operation, workspace_number, monitor_number, function, xid, value in records:
+		monitor_key = '{}:{}'.format(workspace_number, monitor_number)
+		if operation == MONITOR:
+			monitors_state[monitor_key] = {'nmaster': xid, 'mfact': value, 'function': chr(function) if function else None}
+			continue
+		if operation == IDENTITY:
+			identities[xid] = value
+			continue
+		if xid in homes:
+			stacks[homes[xid]].remove(xid)
+		if operation == INSERT:
+			homes[xid] = monitor_key
+		elif operation == REMOVE:
+			homes.pop(xid, None)
+			removed.add(xid)
+			continue
+		if xid in homes:
+			stacks.setdefault(homes[xid], []).insert(int(value), xid)
+	for xid in removed:
+		if xid not in homes:
+			stack_state.pop(str(xid), None)
+	for monitor_key, stack in stacks.items():
+		for index, xid in enumerate(stack):
+			entry = stack_state.setdefault(str(xid), {'name': ''})
+			entry['monitor'] = monitor_key
+			entry['stack_index'] = index
+			if xid in identities:
+				entry['identity'] = list(identities[xid])
+	return snapshot
+
+
+def record(layout, operation, key, function=0, xid=0, value=0, identity=None):
+	payload = json.dumps(list(identity)).encode() if identity else b''
+	JOURNAL.append(operation, key, function=function, xid=xid, value=value, payload=payload)
+	if JOURNAL.records >= COMPACT_RECORDS:
+		compact(layout)
+
+
+def compact(layout):
+	"""
+	Writes a snapshot of the layout and starts an empty journal after it. The layout file is
+	only written here, in between the journal records every mutation
+	"""
+	JOURNAL.sequence += 1
+	write_atomically(layout_file, json.dumps(to_json(layout), indent=True))
+	JOURNAL.snapshots += 1
+	JOURNAL.reset()
+
+
+def write_atomically(path, content):
+	temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+	with open(temporary_path, 'w') as f:
+		f.write(content)
+	os.replace(temporary_path, path)
+
+
+def flush():
+	DECORATIONS_WRITER.flush()
 
 
 def write_decorations(decoration_map):
-	state_json = {}
-	for k in decoration_map.keys():
-		state_json[k] = decoration_map[k]
-	with open(decorations_file, 'w') as f:
-		json.dump(state_json, f, indent=True)
+	DECORATIONS_WRITER.mark(decoration_map)
 
 
 def read_layout():
+	"""
+	The last snapshot with the journal replayed on top of it
+	"""
+	snapshot = None
 	if os.path.exists(layout_file):
 		with open(layout_file, 'r') as f:
 			try:
-				return json.load(f)
+				snapshot = json.load(f)
 			except json.decoder.JSONDecodeError:
-				return None
-	return None
+				pass
+	sequence = snapshot.get('journal', 0) if snapshot else 0
+	records = JOURNAL.read(sequence)
+	if not records:
+		return snapshot
+	return replay(snapshot or {}, records)
 
 
 def read_decorations():
@@ -53,21 +247,25 @@ def read_decorations():
 
 
 def to_json(layout):
+	"""
+	Snapshot of the layout state in a single pass over the stacked windows, using the cached window names
+	and identities
+	"""
 	stack_state = {}
-	state = {
-		'stack_state': stack_state,
-		'nmaster': layout.monitor.nmaster, 'mfact': layout.monitor.mfact,
-		'function': layout.function_key}
-	for w in layout.windows.buffers:
-		w_id = w.get_xid()
-		key = str(w_id)
-		if key not in stack_state:
-			stack_state[key] = {}
-		stack_state[key]['name'] = w.get_name()
-		stack_state[key]['stack_index'] = layout.stack.index(w_id) if w_id in layout.stack else -1
-
-	for client_key in list(stack_state.keys()):
-		if client_key not in map(lambda x: str(x.get_xid()), layout.windows.buffers):
-			del stack_state[client_key]
-
-	return state
+	monitors_state = {}
+	for (workspace_number, monitor_number), monitor in layout.monitors.items():
+		monitors_state['{}:{}'.format(workspace_number, monitor_number)] = {
+			'nmaster': monitor.nmaster, 'mfact': monitor.mfact, 'function': monitor.function_key}
+	names = layout.windows.names
+	for w_id, monitor_key in layout.window_keys.items():
+		identity = layout.identities[w_id]
+		stack_state[str(w_id)] = {
+			'name': names.get(w_id, identity[2]), 'identity': identity, 'monitor': '{}:{}'.format(*monitor_key),
+			'stack_index': layout.monitors[monitor_key].stack.index(w_id)}
+	return {'stack_state': stack_state, 'monitors': monitors_state, 'journal': JOURNAL.sequence}
+
+
+JOURNAL = Journal(journal_file)
+DECORATIONS_WRITER = WriteBehind(
+	decorations_file, lambda decoration_map: {str(k): v for k, v in decoration_map.items()},
+	lambda snapshot: json.dumps(snapshot, indent=True))
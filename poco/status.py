@@ -74,10 +74,9 @@ class StatusIcon:
 		self.layout_submenu = Gtk.Menu()
 		layout_menu_item.set_submenu(self.layout_submenu)
 
-		for function_key in poco.layout.FUNCTIONS_MAP.keys():
-			name = poco.layout.FUNCTIONS_NAME_MAP[function_key]
+		for function_key, layout_function in poco.layout.LAYOUTS.items():
 			menu_item = Gtk.RadioMenuItem(
-				label=name, group=self.layout_submenu.get_children()[0] if self.layout_submenu.get_children() else None)
+				label=layout_function.name, group=self.layout_submenu.get_children()[0] if self.layout_submenu.get_children() else None)
 			menu_item.function_key = function_key
 			menu_item.connect("toggled", self._change_layout)
 			menu_item.show()
@@ -109,14 +108,18 @@ class StatusIcon:
 		for item in self.icons_submenu.get_children():
 			item.set_active(item.icon_style == iconname)
 
+		function_key = self.layout.get_active_monitor().function_key
 		for item in self.layout_submenu.get_children():
-			item.set_active(item.function_key == self.layout.function_key)
+			item.set_active(item.function_key == function_key)
 
 		sys_icon = 'poco'
-		if self.layout.function_key:
-			sys_icon = sys_icon + '-' + self.layout.function_key
+		if function_key in poco.layout.LAYOUTS:
+			sys_icon = sys_icon + '-' + poco.layout.LAYOUTS[function_key].icon_key
 		if iconname == "dark" or iconname == "light":
 			sys_icon = sys_icon + '-' + iconname
+		if not Gtk.IconTheme.get_default().has_icon(sys_icon):
+			# layouts without an installed icon
+			sys_icon = 'poco-' + iconname if iconname == "dark" or iconname == "light" else 'poco'
 		self.ind.set_icon(sys_icon)
 
 		self._reloading = False
@@ -19,6 +19,7 @@ import poco.messages as messages
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk, Pango, GLib
 from poco.messages import BufferName
+from poco.windows import MONITORS
 
 
 # TODO show 'no name' active buffer if no active window at the buffers LIST
@@ -32,6 +33,7 @@ class ReadingWindow(Gtk.Window):
 		self.controller = controller
 		self.windows = windows
 		self.show_app_name = False
+		self.monitor_index = None
 
 		self.set_keep_above(True)
 		self.set_skip_taskbar_hint(True)
@@ -87,12 +89,14 @@ class ReadingWindow(Gtk.Window):
 		self.colon_prompt.set_position(len(self.colon_prompt.get_text()))
 
 	def get_monitor_geometry(self):
-		display = self.get_display()
-		screen, x, y, modifiers = display.get_pointer()
-		monitor_nr = screen.get_monitor_at_point(x, y)
-		return screen.get_monitor_workarea(monitor_nr)
+		if self.monitor_index is None:
+			screen, x, y, modifiers = self.get_display().get_pointer()
+			self.monitor_index = MONITORS.monitor_at_point(x, y)
+		return MONITORS.workarea(self.monitor_index)
 
 	def update(self):
+		# the pointer is read once per update, not on every size allocation
+		self.monitor_index = None
 		self.set_gravity(Gdk.Gravity.NORTH_WEST)
 		for c in self.output_box.get_children(): c.destroy()
 		for c in self.messages_box.get_children(): c.destroy()
@@ -155,8 +159,8 @@ class ReadingWindow(Gtk.Window):
 
 	def _navigation_index(self, window):
 		length = len(self.windows.line)
-		start_position = self.windows.line.index(self.windows.active.get_wnck_window())
-		multiplier = (length + self.windows.line.index(window) - start_position) % len(self.windows.line)
+		start_position = self.windows.line_index[self.windows.active.xid]
+		multiplier = (length + self.windows.line_index[window.get_xid()] - start_position) % length
 		if multiplier == 0:
 			return ''
 		if multiplier == 1:
@@ -16,10 +16,15 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import gi, os, re
+from collections import namedtuple
 import poco.messages as messages
 import poco.configurations as configurations
 import poco.state as state
+from poco.names import counted
 
+from Xlib import X, Xutil
+from Xlib.display import Display
+from Xlib.protocol import event
 gi.require_version('Wnck', '3.0')
 from gi.repository import Wnck, GdkX11, Gdk
 
@@ -58,30 +63,243 @@ VERTICAL.perpendicular_axis = HORIZONTAL
 X_Y_W_H_GEOMETRY_MASK = Wnck.WindowMoveResizeMask.HEIGHT | Wnck.WindowMoveResizeMask.WIDTH |\
 							Wnck.WindowMoveResizeMask.X | Wnck.WindowMoveResizeMask.Y
 STRETCH = 1000
+# pixels a window manager may take from a requested geometry for decorations and size increments
+GEOMETRY_TOLERANCE = 32
+# https://specifications.freedesktop.org/wm-spec/1.3/ar01s04.html#idm46201142858672
+PAGER_SOURCE = 2
+MOVERESIZE_FLAGS = X.StaticGravity | 1 << 8 | 1 << 9 | 1 << 10 | 1 << 11 | PAGER_SOURCE << 12
+CLIENT_MESSAGE_MASK = X.SubstructureRedirectMask | X.SubstructureNotifyMask
+
+# frame and client geometry of a window, as read once from the screen, plus the decoration extents between them
+Geometry = namedtuple('Geometry', [
+	'x', 'y', 'w', 'h', 'client_x', 'client_y', 'client_w', 'client_h', 'decoration_width', 'decoration_height'])
+
+
+class GdkWindowCache:
+	"""
+	Foreign Gdk windows by xid. Entries live until the window is closed
+	"""
+
+	def __init__(self):
+		self.gdk_windows = {}
+		self.hits = self.misses = 0
+
+	def get(self, xid):
+		if xid in self.gdk_windows:
+			self.hits += 1
+		else:
+			self.misses += 1
+			display = GdkX11.X11Display.get_default()
+			self.gdk_windows[xid] = GdkX11.X11Window.foreign_new_for_display(display, xid)
+		return self.gdk_windows[xid]
+
+	def evict(self, xid):
+		self.gdk_windows.pop(xid, None)
+
+	def clear(self):
+		self.gdk_windows.clear()
+
+
+GDK_WINDOWS = GdkWindowCache()
 
 
 def gdk_window_for(window):
-	display = GdkX11.X11Display.get_default()
-	xid = window.get_xid()
-	return GdkX11.X11Window.foreign_new_for_display(display, xid)
+	return GDK_WINDOWS.get(window.get_xid())
+
+
+class MonitorTopology:
+	"""
+	Work areas by monitor index and monitor index by window xid. Refreshed when monitors
+	or their work areas change, window entries when the window moves
+	"""
+
+	def __init__(self):
+		self.display = None
+		self.connected_monitors = []
+		self.workareas = {}
+		self.window_monitors = {}
+		# called after any change to the monitors or their work areas
+		self.invalidate_callbacks = []
+
+	def _connect(self):
+		self.display = Gdk.Display.get_default()
+		self.display.get_default_screen().connect('monitors-changed', self.invalidate)
+		self._connect_monitors()
+
+	def _connect_monitors(self):
+		for i in range(self.display.get_n_monitors()):
+			gdk_monitor = self.display.get_monitor(i)
+			if gdk_monitor not in self.connected_monitors:
+				gdk_monitor.connect('notify::workarea', self.invalidate)
+				self.connected_monitors.append(gdk_monitor)
+
+	def monitor_for(self, window):
+		if not self.display:
+			self._connect()
+		xid = window.get_xid()
+		if xid not in self.window_monitors:
+			gdk_monitor = self.display.get_monitor_at_window(gdk_window_for(window))
+			self.window_monitors[xid] = next(
+				(i for i in range(self.display.get_n_monitors()) if self.display.get_monitor(i) == gdk_monitor), 0)
+		return self.window_monitors[xid]
+
+	def count(self):
+		if not self.display:
+			self._connect()
+		return self.display.get_n_monitors()
+
+	def monitor_at_point(self, x, y):
+		if not self.display:
+			self._connect()
+		return self.display.get_default_screen().get_monitor_at_point(x, y)
+
+	def workarea(self, monitor_index):
+		"""
+		The work area of the monitor, None if there is no monitor at the index anymore
+		"""
+		if not self.display:
+			self._connect()
+		if monitor_index not in self.workareas:
+			gdk_monitor = self.display.get_monitor(monitor_index)
+			if not gdk_monitor:
+				return None
+			self.workareas[monitor_index] = gdk_monitor.get_workarea()
+		return self.workareas[monitor_index]
+
+	def evict(self, xid):
+		self.window_monitors.pop(xid, None)
+
+	def invalidate(self, *args):
+		self.workareas.clear()
+		self.window_monitors.clear()
+		if self.display:
+			self._connect_monitors()
+		for callback in self.invalidate_callbacks:
+			callback()
+
+
+MONITORS = MonitorTopology()
 
 
 def monitor_work_area_for(window):
-	gdk_window = gdk_window_for(window)
-	gdk_display = gdk_window.get_display()
-	gdk_monitor = gdk_display.get_monitor_at_window(gdk_window)
-	return gdk_monitor.get_workarea()
+	return MONITORS.workarea(MONITORS.monitor_for(window))
+
+
+class DecorationRegistry:
+	"""
+	Original decorations of the windows whose title bar poco removed, by xid. Read from the
+	state file once and written back behind, so decorating a window costs no file I/O
+	"""
+
+	def __init__(self):
+		self.originals = None
+
+	def _load(self):
+		if self.originals is None:
+			self.originals = {int(k): v for k, v in (state.read_decorations() or {}).items()}
+
+	def remove(self, window):
+		self._load()
+		xid = window.get_xid()
+		gdk_w = gdk_window_for(window)
+		is_decorated, decorations = gdk_w.get_decorations()
+		if xid not in self.originals:
+			if not is_decorated and not decorations:
+				# assume server side decoration
+				decorations = Gdk.WMDecoration.ALL
+			self.originals[xid] = int(decorations)
+			state.write_decorations(self.originals)
+		has_title = Gdk.WMDecoration.TITLE & decorations or Gdk.WMDecoration.ALL & decorations
+		if not is_decorated or has_title:
+			gdk_w.set_decorations(Gdk.WMDecoration.BORDER)
 
+	def restore(self, window):
+		self._load()
+		xid = window.get_xid()
+		if xid in self.originals:
+			gdk_window_for(window).set_decorations(Gdk.WMDecoration(self.originals[xid]))
 
-def decoration_size_for(window):
-	gdk_w = gdk_window_for(window)
-	is_decorated, decorations = gdk_w.get_decorations()
+	def forget(self, xid):
+		if self.originals and self.originals.pop(xid, None) is not None:
+			state.write_decorations(self.originals)
+
+	def prune(self, xids):
+		"""
+		Forgets the windows not in xids, gone while poco was not running
+		"""
+		self._load()
+		for xid in [xid for xid in self.originals if xid not in xids]:
+			self.forget(xid)
+
+
+DECORATIONS = DecorationRegistry()
+
+
+def geometry_for(window):
 	x, y, w, h = window.get_geometry()
 	cx, cy, cw, ch = window.get_client_window_geometry()
-	decoration_width = cx - x
-	decoration_height = cy - y
+	return Geometry(x, y, w, h, cx, cy, cw, ch, cx - x, cy - y)
+
+
+def identity_for(window):
+	"""
+	Key of the window that survives restarts and logins, when its xid and pid change
+	"""
+	return window.get_class_group_name() or '', window.get_role() or '', title_stem(window.get_name())
+
 
-	return is_decorated, decorations, decoration_width, decoration_height
+def title_stem(title):
+	"""
+	The title without the numbers that change from one run to another, such as pids or counters
+	"""
+	return ' '.join(re.sub(r'\d+', '', title or '').split()).lower()
+
+
+def agrees_with(frame, requested):
+	"""
+	If the frame is where the window manager would put a window asked to be at the requested
+	geometry, give or take decorations and size increments
+	"""
+	return all(abs(f - r) <= GEOMETRY_TOLERANCE for f, r in zip(frame, requested))
+
+
+def decoration_size_for(window, geometry):
+	gdk_w = gdk_window_for(window)
+	is_decorated, decorations = gdk_w.get_decorations()
+	return is_decorated, decorations, geometry.decoration_width, geometry.decoration_height
+
+
+class Transaction:
+	"""
+	Collects requests to many windows and sends them to the X server in a single batch,
+	as client messages to the root window, with one flush at commit
+	"""
+
+	def __init__(self, connection):
+		self.connection = connection
+		self.requests = []
+
+	def set_geometry(self, xid, x, y, w, h):
+		self.requests.append(('_NET_MOVERESIZE_WINDOW', xid, [MOVERESIZE_FLAGS, int(x), int(y), int(w), int(h)]))
+
+	def minimize(self, xid):
+		self.requests.append(('WM_CHANGE_STATE', xid, [Xutil.IconicState, 0, 0, 0, 0]))
+
+	def close(self, xid, time):
+		self.requests.append(('_NET_CLOSE_WINDOW', xid, [time or X.CurrentTime, PAGER_SOURCE, 0, 0, 0]))
+
+	def commit(self):
+		if not self.requests:
+			return
+		root = self.connection.screen().root
+		for atom_name, xid, data in self.requests:
+			client_message = event.ClientMessage(
+				window=self.connection.create_resource_object('window', xid),
+				client_type=self.connection.get_atom(atom_name),
+				data=(32, data))
+			root.send_event(client_message, event_mask=CLIENT_MESSAGE_MASK)
+		self.connection.flush()
+		self.requests.clear()
 
 
 def unsnap(window):
@@ -104,67 +322,255 @@ class Windows:
 		self.visible = []
 		self.visible_map = {}
 		self.buffers = []
+		self.buffers_map = {}
+		self.names = {}
+		self.geometry_map = {}
+		# xid to the last requested geometry and the frame geometry it resulted in
+		self.arranged = {}
 		self.screen = None
 		self.line = self.column = None
-
-	def is_visible(self, window):
+		self.line_index = {}
+		self.column_index = {}
+		self.stacked = []
+		self.stacked_index = {}
+		self.window_handlers = {}
+		self.screen_handlers = []
+		self.x_connection = None
+		# line and column are sorted lazily, after any geometry change, the same for stacked after a restack
+		self.sorted = False
+		self.restacked = False
+
+	def is_stackable(self, window):
+		"""
+		If the window can be arranged by a layout, in any workspace
+		"""
 		if window.get_pid() == os.getpid():
 			return False
 		if window.is_skip_tasklist():
 			return False
-		active_workspace = self.screen.get_active_workspace()
-		return window.is_in_viewport(active_workspace) and not window.is_minimized()
+		return not window.is_minimized()
 
 	def read_screen(self, force_update=True):
+		"""
+		Rebuilds the window model from the screen. After the first read, the model
+		is kept current by Wnck signals, see refresh()
+		"""
 		del self.buffers[:]
 		del self.visible[:]
+		self.buffers_map.clear()
 		self.visible_map.clear()
+		self.geometry_map.clear()
 		self.active.clean()
+		self.restacked = False
 
 		if not self.screen:
 			self.screen = Wnck.Screen.get_default()
+			self._install_screen_handlers()
 
 		if force_update:
 			self.screen.force_update()  # make sure we query X server
 
-		active_workspace = self.screen.get_active_workspace()
 		for wnck_window in self.screen.get_windows():
-			if wnck_window.get_pid() == os.getpid():
-				continue
-			if wnck_window.is_skip_tasklist():
-				continue
-			in_active_workspace = wnck_window.is_in_viewport(active_workspace)
-			if in_active_workspace or self.list_workspaces:
-				self.buffers.append(wnck_window)
-			if in_active_workspace and not wnck_window.is_minimized():
-				self.visible.append(wnck_window)
-				self.visible_map[wnck_window.get_xid()] = wnck_window
+			self._install_window_handlers(wnck_window)
+			self._add(wnck_window)
 
 		self.update_active()
+		self.sort()
+
+	def refresh(self):
+		"""
+		Prepares the in memory window model to be read by a command, with no X server round trip
+		"""
+		if not self.screen:
+			self.read_screen()
+			return
+		self.active.clean()
+		self.update_active()
+		if not self.sorted:
+			self.sort()
+
+	def sort(self):
 		self.line = sorted(list(self.visible), key=self.sort_line)
 		self.column = sorted(list(self.visible), key=self.sort_column)
+		self.line_index = {w.get_xid(): i for i, w in enumerate(self.line)}
+		self.column_index = {w.get_xid(): i for i, w in enumerate(self.column)}
+		self.sorted = True
+
+	def restack(self):
+		self.stacked = [w for w in self.screen.get_windows_stacked() if w.get_xid() in self.visible_map]
+		self.stacked_index = {w.get_xid(): i for i, w in enumerate(self.stacked)}
+		self.restacked = True
+
+	def get_geometry(self, window):
+		"""
+		Returns the geometry snapshot of the window, read from the screen only
+		if it changed since the last read
+		"""
+		xid = window.get_xid()
+		if xid not in self.geometry_map:
+			self.geometry_map[xid] = geometry_for(window)
+		return self.geometry_map[xid]
 
 	def update_active(self):
-		for stacked in reversed(self.screen.get_windows_stacked()):
-			if stacked in self.visible:
-				self.active.xid = stacked.get_xid()
-				break
+		if not self.restacked:
+			self.restack()
+		if self.stacked:
+			self.active.xid = self.stacked[-1].get_xid()
+
+	def _add(self, wnck_window):
+		if wnck_window.get_pid() == os.getpid():
+			return
+		if wnck_window.is_skip_tasklist():
+			return
+		in_active_workspace = wnck_window.is_in_viewport(self.screen.get_active_workspace())
+		if in_active_workspace or self.list_workspaces:
+			self.buffers.append(wnck_window)
+			self.buffers_map[wnck_window.get_xid()] = wnck_window
+			self.names[wnck_window.get_xid()] = wnck_window.get_name()
+		if in_active_workspace and not wnck_window.is_minimized():
+			self.visible.append(wnck_window)
+			self.visible_map[wnck_window.get_xid()] = wnck_window
+		self.sorted = self.restacked = False
+
+	def _discard(self, wnck_window):
+		xid = wnck_window.get_xid()
+		if xid in self.buffers_map:
+			self.buffers.remove(self.buffers_map.pop(xid))
+		if xid in self.visible_map:
+			self.visible.remove(self.visible_map.pop(xid))
+		self.names.pop(xid, None)
+		self.geometry_map.pop(xid, None)
+		self.arranged.pop(xid, None)
+		self.sorted = self.restacked = False
+
+	def _reload(self, wnck_window):
+		"""
+		Places the window back in the model, at its screen order, after a state or workspace change
+		"""
+		self._discard(wnck_window)
+		self._add(wnck_window)
+		order = {w.get_xid(): i for i, w in enumerate(self.screen.get_windows())}
+		self.buffers.sort(key=lambda w: order.get(w.get_xid(), -1))
+		self.visible.sort(key=lambda w: order.get(w.get_xid(), -1))
+
+	def _install_screen_handlers(self):
+		self.screen_handlers = [
+			self.screen.connect('window-opened', self._window_opened),
+			self.screen.connect('window-closed', self._window_closed),
+			self.screen.connect('active-window-changed', self._active_window_changed),
+			self.screen.connect('window-stacking-changed', self._window_stacking_changed),
+			self.screen.connect('active-workspace-changed', self._active_workspace_changed)]
+
+	def _install_window_handlers(self, wnck_window):
+		xid = wnck_window.get_xid()
+		if xid in self.window_handlers:
+			return
+		self.window_handlers[xid] = [
+			wnck_window.connect('state-changed', self._window_state_changed),
+			wnck_window.connect('workspace-changed', self._window_workspace_changed),
+			wnck_window.connect('geometry-changed', self._window_geometry_changed),
+			wnck_window.connect('name-changed', self._window_name_changed)]
+
+	def _uninstall_handlers(self):
+		for handler_id in self.screen_handlers:
+			self.screen.disconnect(handler_id)
+		self.screen_handlers = []
+		for wnck_window in self.screen.get_windows():
+			for handler_id in self.window_handlers.pop(wnck_window.get_xid(), []):
+				wnck_window.disconnect(handler_id)
+		self.window_handlers.clear()
+
+	#
+	# CALLBACKS
+	#
+	def _window_opened(self, screen, wnck_window):
+		self._install_window_handlers(wnck_window)
+		self._add(wnck_window)
+
+	def _window_closed(self, screen, wnck_window):
+		self.window_handlers.pop(wnck_window.get_xid(), None)
+		GDK_WINDOWS.evict(wnck_window.get_xid())
+		MONITORS.evict(wnck_window.get_xid())
+		DECORATIONS.forget(wnck_window.get_xid())
+		self._discard(wnck_window)
+		if self.active.xid == wnck_window.get_xid():
+			self.active.clean()
+		self.update_active()
+
+	def _active_window_changed(self, screen, previously_active_window):
+		self.active.clean()
+		self.update_active()
+
+	def _window_stacking_changed(self, screen):
+		self.restacked = False
+
+	def _active_workspace_changed(self, screen, previously_active_space):
+		del self.buffers[:]
+		del self.visible[:]
+		self.buffers_map.clear()
+		self.visible_map.clear()
+		self.names.clear()
+		for wnck_window in self.screen.get_windows():
+			self._add(wnck_window)
+		self.active.clean()
+		self.update_active()
+
+	def _window_state_changed(self, wnck_window, changed_mask, new_state):
+		if changed_mask & (Wnck.WindowState.MINIMIZED | Wnck.WindowState.SKIP_TASKLIST):
+			self._reload(wnck_window)
+
+	def _window_workspace_changed(self, wnck_window):
+		self._reload(wnck_window)
+
+	def _window_geometry_changed(self, wnck_window):
+		xid = wnck_window.get_xid()
+		self.geometry_map.pop(xid, None)
+		MONITORS.evict(xid)
+		if xid in self.arranged:
+			requested, resulting = self.arranged[xid]
+			frame = tuple(self.get_geometry(wnck_window)[:4])
+			if resulting is None:
+				# a frame away from the request is a move by someone else, or a step before the request
+				if agrees_with(frame, requested):
+					self.arranged[xid] = (requested, frame)
+			elif resulting != frame:
+				# moved by someone else
+				del self.arranged[xid]
+		self.sorted = False
+
+	def _window_name_changed(self, wnck_window):
+		if wnck_window.get_xid() in self.names:
+			self.names[wnck_window.get_xid()] = wnck_window.get_name()
 
 	def sort_line(self, w):
-		geometry = w.get_geometry()
-		return geometry.xp * STRETCH + geometry.yp
+		geometry = self.get_geometry(w)
+		return geometry.x * STRETCH + geometry.y
 
 	def sort_column(self, w):
-		geometry = w.get_geometry()
-		return geometry.yp * STRETCH + geometry.xp
+		geometry = self.get_geometry(w)
+		return geometry.y * STRETCH + geometry.x
 
 	def clear_state(self):
+		if self.screen:
+			self._uninstall_handlers()
+		GDK_WINDOWS.clear()
 		self.screen = None
 		self.active.clean()
 		self.visible =[]
+		self.visible_map = {}
 		self.buffers =[]
+		self.buffers_map = {}
+		self.names = {}
+		self.geometry_map = {}
+		self.arranged = {}
 		self.line = None
 		self.column = None
+		self.line_index = {}
+		self.column_index = {}
+		self.stacked = []
+		self.stacked_index = {}
+		self.sorted = False
+		self.restacked = False
 
 	#
 	# API
@@ -177,56 +583,40 @@ class Windows:
 			self.active.get_wnck_window().activate_transient(event_time)
 			self.staging = False
 
-	def remove(self, window, time):
-		window.close(time)
-		self.visible.remove(window)
-		self.buffers.remove(window)
-		self.update_active()
+	def transaction(self):
+		if not self.x_connection:
+			self.x_connection = Display()
+		return Transaction(self.x_connection)
 
-	def apply_decoration_config(self):
-		if configurations.is_remove_decorations():
-			self.remove_decorations()
+	def remove(self, window, time, transaction=None):
+		"""
+		Asks the window to close. The window leaves the model when Wnck reports it closed,
+		it may refuse or delay the close, as when prompting to save changes
+		"""
+		if transaction:
+			transaction.close(window.get_xid(), time)
 		else:
-			self.restore_decorations()
+			window.close(time)
 
-	def remove_decorations(self):
-		decoration_map = state.read_decorations()
-		if not decoration_map:
-			decoration_map = {}
-		for w in self.buffers:
-			key = str(w.get_xid())
-			is_decorated, decorations = gdk_window_for(w).get_decorations()
-			gdk_w = gdk_window_for(w)
-			if key not in decoration_map:
-				if not is_decorated and not decorations:
-					# assume server side decoration
-					decorations = Gdk.WMDecoration.ALL
-				decoration_map[key] = decorations
-			has_title = Gdk.WMDecoration.TITLE & decorations or Gdk.WMDecoration.ALL & decorations
-			if not is_decorated or has_title:
-				gdk_w.set_decorations(Gdk.WMDecoration.BORDER)
-		for key in list(decoration_map.keys()):
-			if key not in map(lambda x: str(x.get_xid()), self.buffers):
-				del decoration_map[key]
-		state.write_decorations(decoration_map)
-
-	def restore_decorations(self):
-		decoration_map = state.read_decorations()
+	def apply_decoration_config(self):
+		DECORATIONS.prune(set(map(lambda x: x.get_xid(), self.screen.get_windows())))
 		for w in self.buffers:
-			key = str(w.get_xid())
-			gdk_w = gdk_window_for(w)
-			if key in decoration_map:
-				original = decoration_map[key]
-				gdk_w.set_decorations(Gdk.WMDecoration(original))
+			self.apply_decoration_config_to(w)
+
+	def apply_decoration_config_to(self, window):
+		if configurations.is_remove_decorations():
+			DECORATIONS.remove(window)
+		else:
+			DECORATIONS.restore(window)
 
 	#
 	# Query API
 	#
 	def find_by_name(self, name):
-		return next((w for w in self.buffers if name.lower().strip() in w.get_name().lower()), None)
+		return next((w for w in self.buffers if name.lower().strip() in self.names[w.get_xid()].lower()), None)
 
 	def list_completions(self, name):
-		names = map(lambda x: x.get_name().strip(), self.buffers)
+		names = map(lambda x: self.names[x.get_xid()].strip(), self.buffers)
 		filtered = filter(lambda x: name.lower().strip() in x.lower(), names)
 		return list(filtered)
 
@@ -268,8 +658,10 @@ class Windows:
 					to_delete.append(self.buffers[index])
 				else:
 					return messages.Message('No buffers were deleted', 'error')
+			transaction = self.transaction()
 			for window in to_delete:
-				self.remove(window, c_in.time)
+				self.remove(window, c_in.time, transaction=transaction)
+			transaction.commit()
 			self.staging = True if to_delete else False
 		elif re.match(r'^\s*(bdelete|bd)\s+\w+\s*$', c_in.text):
 			window_title = c_in.vim_command_parameter
@@ -291,18 +683,16 @@ class Windows:
 	def get_top_two_windows(self):
 		top = self.active.get_wnck_window()
 		below = None
-		after_top = False
-		for w in reversed(self.screen.get_windows_stacked()):
-			if w in self.visible and after_top:
-				below = w
-				break
-			if w is top:
-				after_top = True
+		if not self.restacked:
+			self.restack()
+		if self.active.xid in self.stacked_index:
+			i = self.stacked_index[self.active.xid]
+			below = self.stacked[i - 1] if i > 0 else None
 		return top, below
 
 	def get_left_right_top_windows(self):
 		top, below = self.get_top_two_windows()
-		if top and below and below.get_geometry().xp < top.get_geometry().xp:
+		if top and below and self.get_geometry(below).x < self.get_geometry(top).x:
 			return below, top
 		else:
 			return top, below
@@ -338,13 +728,32 @@ class Windows:
 		self.set_geometry(self.active.get_wnck_window(), x=x, y=y)
 		self.staging = True
 
-	def set_geometry(self, window, x=None, y=None, w=None, h=None):
+	def is_arranged(self, window, x, y, w, h):
+		"""
+		If the window is still where the last request for this same geometry placed it
+		"""
+		xid = window.get_xid()
+		if xid not in self.arranged:
+			return False
+		requested, resulting = self.arranged[xid]
+		return requested == (x, y, w, h) and resulting == tuple(self.get_geometry(window)[:4])
+
+	def confirmed_request(self, xid):
+		"""
+		The geometry of the last request for the window, if the window is still where it resulted
+		"""
+		if xid in self.arranged and self.arranged[xid][1] is not None:
+			return self.arranged[xid][0]
+		return None
+
+	def set_geometry(self, window, x=None, y=None, w=None, h=None, transaction=None):
+		geometry = self.get_geometry(window)
 		if not w and not h:
-			geometry = window.get_geometry()
-			w = geometry.widthp
-			h = geometry.heightp
+			w = geometry.w
+			h = geometry.h
+		self.arranged[window.get_xid()] = ((x, y, w, h), None)
 
-		is_decorated, decorations, decoration_width, decoration_height = decoration_size_for(window)
+		is_decorated, decorations, decoration_width, decoration_height = decoration_size_for(window, geometry)
 		has_title = Gdk.WMDecoration.TITLE & decorations or Gdk.WMDecoration.ALL & decorations
 
 		if is_decorated and not has_title and decoration_width >= 0 and decoration_height >= 0:
@@ -356,19 +765,23 @@ class Windows:
 		# print("monitor: x={}  w={} y={}  h={}".format(monitor_geo.x, monitor_geo.width, monitor_geo.y, monitor_geo.height))
 		# print("window: x={} y={} width={} height={}".format(x, y, w, h))
 
-		window.set_geometry(Wnck.WindowGravity.STATIC, X_Y_W_H_GEOMETRY_MASK, x, y, w, h)
+		if transaction:
+			transaction.set_geometry(window.get_xid(), x, y, w, h)
+		else:
+			window.set_geometry(Wnck.WindowGravity.STATIC, X_Y_W_H_GEOMETRY_MASK, x, y, w, h)
 
 	#
 	# Internal API
 	#
 	def get_metadata_resume(self):
-		resume = ''
+		resume = 'gdk windows: {} cached, {} hits, {} misses\n'.format(
+			len(GDK_WINDOWS.gdk_windows), GDK_WINDOWS.hits, GDK_WINDOWS.misses)
 		for wn in self.buffers:
 			gdk_w = gdk_window_for(wn)
 			is_decorated, decorations = gdk_w.get_decorations()
-			x, y, w, h = wn.get_geometry()
-			cx, cy, cw, ch = wn.get_client_window_geometry()
-			is_decorated, decorations, decoration_width, decoration_height = decoration_size_for(wn)
+			geometry = self.get_geometry(wn)
+			x, y, cx, cy = geometry.x, geometry.y, geometry.client_x, geometry.client_y
+			is_decorated, decorations, decoration_width, decoration_height = decoration_size_for(wn, geometry)
 			compensate = is_decorated and not decorations and decoration_width >= 0 and decoration_height >= 0
 			resume += '{:10} - {:20}\n'.format(
 				wn.get_xid(), wn.get_name()[:10])
@@ -388,10 +801,7 @@ class Active:
 		self.xid = None
 
 	def get_wnck_window(self):
-		for w in self.windows.buffers:
-			if w.get_xid() == self.xid:
-				return w
-		return None
+		return self.windows.buffers_map.get(self.xid)
 
 	def clean(self):
 		self.xid = None
@@ -402,9 +812,11 @@ class Active:
 			self.windows.staging = True
 
 	def only(self, c_in):
+		transaction = self.windows.transaction()
 		for w in self.windows.visible:
 			if self.xid != w.get_xid():
-				w.minimize()
+				transaction.minimize(w.get_xid())
+		transaction.commit()
 		self.windows.staging = True
 
 	def minimize(self, c_in):
@@ -412,6 +824,8 @@ class Active:
 			active_window = self.get_wnck_window()
 			active_window.minimize()
 			self.windows.visible.remove(active_window)
+			del self.windows.visible_map[self.xid]
+			self.windows.sorted = self.windows.restacked = False
 			self.windows.update_active()
 			self.windows.staging = True
 
@@ -455,35 +869,42 @@ class Focus:
 		self.windows = windows
 		self.active = windows.active
 
+	@counted
 	def move_right(self, c_in):
-		self.move(1, HORIZONTAL)
+		self.move(c_in.count, HORIZONTAL)
 
+	@counted
 	def move_left(self, c_in):
-		self.move(-1, HORIZONTAL)
+		self.move(-c_in.count, HORIZONTAL)
 
+	@counted
 	def move_up(self, c_in):
-		self.move(-1, VERTICAL)
+		self.move(-c_in.count, VERTICAL)
 
+	@counted
 	def move_down(self, c_in):
-		self.move(1, VERTICAL)
+		self.move(c_in.count, VERTICAL)
 
 	def move_to_previous(self, c_in):
-		stack = list(filter(lambda x: x in self.windows.visible, self.windows.screen.get_windows_stacked()))
-		i = stack.index(self.active.get_wnck_window())
+		stack = self.windows.stacked
+		i = self.windows.stacked_index[self.active.xid]
 		self.active.xid = stack[i - 1].get_xid()
 		self.windows.staging = True
 
 	def move(self, increment, axis):
 		oriented_list = self.windows.line if axis is HORIZONTAL else self.windows.column
-		index = oriented_list.index(self.active.get_wnck_window()) + increment
-		if 0 <= index < len(oriented_list):
-			self.active.xid = oriented_list[index].get_xid()
+		oriented_index = self.windows.line_index if axis is HORIZONTAL else self.windows.column_index
+		index = oriented_index[self.active.xid] + increment
+		index = min(max(index, 0), len(oriented_list) - 1)
+		self.active.xid = oriented_list[index].get_xid()
 		self.windows.staging = True
 
+	@counted
 	def cycle(self, c_in):
 		# TODO: update after case insensitive bindings
 		direction = 1 if not c_in or Gdk.keyval_name(c_in.keyval).islower() else -1
-		i = self.windows.line.index(self.active.get_wnck_window())
-		next_window = self.windows.line[(i + direction) % len(self.windows.line)]
+		count = c_in.count if c_in else 1
+		i = self.windows.line_index[self.active.xid]
+		next_window = self.windows.line[(i + count * direction) % len(self.windows.line)]
 		self.active.xid = next_window.get_xid()
 		self.windows.staging = True
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
+import os
 from distutils.core import setup
 
 FUNCTION_KEYS = ['', 'C', 'T', 'M']
+# exported by data/icon/populate.sh, the status icon falls back to the logo without them
+OPTIONAL_FUNCTION_KEYS = ['G', 'B', 'F', 'D']
 
 icons = [
 	('/usr/share/icons/hicolor/symbolic', ['data/icon/poco.svg']),
@@ -10,13 +13,14 @@ icons = [
 
 for size in (16, 48, 256):
 	for name_diff in ('', '-light'):
-		for layout_key in FUNCTION_KEYS:
+		for layout_key in FUNCTION_KEYS + OPTIONAL_FUNCTION_KEYS:
 			key_func_name_diff = ''
 			if layout_key:
 				key_func_name_diff = key_func_name_diff + '-' + layout_key
-			icons.append((
-				'/usr/share/icons/hicolor/{}x{}/apps'.format(size, size),
-				['data/icon/{}x{}/poco{}{}.png'.format(size, size, key_func_name_diff, name_diff)]))
+			icon_path = 'data/icon/{}x{}/poco{}{}.png'.format(size, size, key_func_name_diff, name_diff)
+			if layout_key in OPTIONAL_FUNCTION_KEYS and not os.path.exists(icon_path):
+				continue
+			icons.append(('/usr/share/icons/hicolor/{}x{}/apps'.format(size, size), [icon_path]))
 
 setup(
 	name='Poco',
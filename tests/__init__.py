@@ -3,11 +3,31 @@ import tests.names
 import tests.terminal
 import tests.assistant
 import tests.layout
+import tests.rules
+import tests.state
+import tests.keyboard
+import tests.windows
 
 test_case_classes = (tests.names.CommandInputTestCase,
                      tests.terminal.TerminalTestCase,
                      tests.assistant.AssistantTestCase,
-                     tests.layout.LayoutTestCase
+                     tests.layout.LayoutTestCase,
+                     tests.layout.StackTestCase,
+                     tests.layout.PlannerTestCase,
+                     tests.layout.RestoreTestCase,
+                     tests.layout.MonitorsTestCase,
+                     tests.layout.WorkspacesTestCase,
+                     tests.layout.PlacementTestCase,
+                     tests.layout.LayoutRulesTestCase,
+                     tests.layout.SchedulerTestCase,
+                     tests.rules.RulesTestCase,
+                     tests.state.WriteBehindTestCase,
+                     tests.state.JournalTestCase,
+                     tests.keyboard.KeyboardListenerTestCase,
+                     tests.keyboard.KeyTestCase,
+                     tests.windows.ArrangedTestCase,
+                     tests.windows.WindowModelTestCase,
+                     tests.windows.TransactionTestCase
                      )
 
 
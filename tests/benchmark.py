@@ -0,0 +1,48 @@
+"""
+Times each registered layout, without the arrangement cache, for growing stack sizes,
+and the keyboard listener parsing recorded key events:
+
+	python3 -m tests.benchmark
+"""
+import timeit
+from types import SimpleNamespace
+from Xlib import X
+import poco.layout as layout
+from poco.layout import Monitor
+from poco.keyboard import KeyboardListener, KeyNode, KEY_EVENT
+
+STACK_SIZES = (1, 4, 8, 16, 64, 256)
+REPEAT = 1000
+RECORDED_EVENTS = 1000000
+
+
+def benchmark_layouts():
+	monitor = Monitor(nmaster=1, mfact=0.55)
+	monitor.set_workarea(0, 0, 3840, 2160)
+	print('{:<16}{:<8}'.format('layout', 'bound') + ''.join('{:>10}'.format('n=' + str(n)) for n in STACK_SIZES))
+	for layout_function in layout.LAYOUTS.values():
+		row = '{:<16}{:<8}'.format(layout_function.name, layout_function.complexity)
+		for n in STACK_SIZES:
+			seconds = timeit.timeit(
+				lambda: layout.to_geometry(*layout_function.arrange(n, monitor)), number=REPEAT)
+			row += '{:>8.1f}us'.format(seconds / REPEAT * 1e6)
+		print(row)
+
+
+def benchmark_record_parser():
+	listener = KeyboardListener.__new__(KeyboardListener)
+	listener.mod_keys_set = {37, 50, 64}
+	listener.modifiers_count = listener.modified_count = 0
+	listener.sequences = KeyNode()
+	listener._reset_sequence()
+	# typing in other applications: presses and releases of unbound keys
+	reply = SimpleNamespace(data=b''.join(
+		KEY_EVENT.pack(X.KeyRelease if i % 2 else X.KeyPress, 24 + i // 2 % 30, i, 0)
+		for i in range(RECORDED_EVENTS)))
+	seconds = timeit.timeit(lambda: listener.handler(reply), number=1)
+	print('record parser: {:.1f} million events per second'.format(RECORDED_EVENTS / seconds / 1e6))
+
+
+if __name__ == '__main__':
+	benchmark_layouts()
+	benchmark_record_parser()
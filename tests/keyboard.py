@@ -0,0 +1,160 @@
+import unittest
+import poco.keyboard as keyboard
+from unittest.mock import MagicMock, patch
+from poco.keyboard import Key, KeyboardListener
+
+CTRL = 4
+# accelerator to key value, code and mask
+ACCELERATORS = {
+	'<Ctrl>q': ('q', 24, CTRL), '<Ctrl>j': ('j', 44, CTRL), 'g': ('g', 42, 0), 't': ('t', 28, 0),
+	'w': ('w', 25, 0), '2': ('2', 11, 0), '3': ('3', 12, 0)}
+KEY_NAMES = {code: name for name, code, mask in ACCELERATORS.values()}
+
+
+class KeyboardListenerTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.patches = [
+			patch.object(keyboard, 'parse_accelerator', side_effect=lambda a: ACCELERATORS[a]),
+			patch.object(keyboard, 'normalize_state', side_effect=lambda state: state),
+			patch.object(keyboard, 'Gdk'),
+			patch.object(keyboard.X, 'KeyPress', 2),
+			patch.object(keyboard.X, 'KeyRelease', 3)]
+		for p in self.patches:
+			p.start()
+		keyboard.Gdk.Keymap.get_default.return_value.translate_keyboard_state.side_effect = \
+			lambda code, state, group: (True, code, 0, 0, 0)
+		keyboard.Gdk.keyval_name.side_effect = lambda keyval: KEY_NAMES[keyval]
+		self.listener = KeyboardListener.__new__(KeyboardListener)
+		self.listener.stopped = False
+		self.listener.root = self.listener.well_connection = MagicMock()
+		self.listener.modifiers_count = self.listener.modified_count = 0
+		self.listener.sequences = keyboard.KeyNode()
+		self.listener._reset_sequence()
+		self.listener.callback = MagicMock()
+		self.listener.mod_keys_set = {37}
+		self.prefix = Key(['<Ctrl>q'], 'prefix')
+		self.window = Key(['<Ctrl>q', 'w'], 'window')
+		self.tab = Key(['<Ctrl>q', 'g', 't'], 'tab', timeout=500)
+		for key in (self.prefix, self.window, self.tab, Key(['<Ctrl>j'], 'down')):
+			self.listener.bind(key)
+
+	def tearDown(self):
+		for p in self.patches:
+			p.stop()
+
+	def press(self, accelerator, time=0):
+		_, code, mask = ACCELERATORS[accelerator]
+		self.listener.modified_count = 1 if mask else 0
+		self.listener.handle_keypress(code, mask, time)
+
+	def called(self):
+		return [(c[0][0].function, c[1]['multiplier']) for c in self.listener.callback.call_args_list]
+
+	def test_single_key(self):
+		self.press('<Ctrl>j')
+		self.assertEqual([('down', 1)], self.called())
+
+	def test_prefix_fires_and_starts_a_sequence(self):
+		self.press('<Ctrl>q')
+		self.press('w')
+		self.assertEqual([('prefix', 1), ('window', 1)], self.called())
+
+	def test_three_key_sequence(self):
+		self.press('<Ctrl>q')
+		self.press('g')
+		self.press('t')
+		self.press('t')
+		self.assertEqual([('prefix', 1), ('tab', 1)], self.called())
+
+	def test_counts_multiply_along_the_sequence(self):
+		self.press('<Ctrl>q')
+		self.press('2')
+		self.press('g')
+		self.press('3')
+		self.press('t')
+		self.assertEqual([('prefix', 1), ('tab', 6)], self.called())
+
+	def test_sequence_timeout(self):
+		self.press('<Ctrl>q', time=0)
+		self.press('g', time=100)
+		self.press('t', time=700)
+		self.assertEqual([('prefix', 1)], self.called())
+
+	def test_sequence_bound_again_with_a_shorter_timeout(self):
+		self.listener.bind(Key(['<Ctrl>q', 'g', 't'], 'tab', timeout=100))
+		self.press('<Ctrl>q', time=0)
+		self.press('g', time=50)
+		self.press('t', time=300)
+		self.assertEqual([('prefix', 1)], self.called())
+		self.assertEqual(1, len(self.listener.sequences.children[(24, CTRL)].children[(42, 0)].timeouts))
+
+	def test_unbound_step_ends_the_sequence(self):
+		self.press('<Ctrl>q')
+		self.press('t')
+		self.press('w')
+		self.assertEqual([('prefix', 1)], self.called())
+
+	def test_callback_event(self):
+		self.press('<Ctrl>j', time=1234)
+		event = self.listener.callback.call_args[0][1]
+		self.assertEqual((44, CTRL, 1234, 44), (event.detail, event.state, event.time, event.keyval))
+
+	def test_record_reply(self):
+		events = [(2, 37, 0), (2, 44, CTRL), (3, 44, CTRL), (3, 37, 0), (2 | keyboard.SENT_EVENT_FLAG, 37, 0),
+				  (2, 44, CTRL), (6, 44, CTRL)]
+		data = b''.join(keyboard.KEY_EVENT.pack(t, code, 1000 + i, state) for i, (t, code, state) in enumerate(events))
+		self.listener.handler(MagicMock(data=data + b'\x00' * 5))
+		self.assertEqual([('down', 1), ('down', 1)], self.called())
+		self.assertEqual(1001, self.listener.callback.call_args_list[0][0][1].time)
+
+	def test_other_events_are_not_unpacked(self):
+		events = [(6, 44, CTRL), (2, 37, 0), (4, 44, CTRL), (2, 44, CTRL)]
+		data = b''.join(keyboard.KEY_EVENT.pack(t, code, 1000 + i, state) for i, (t, code, state) in enumerate(events))
+		with patch.object(keyboard, 'KEY_EVENT', MagicMock(wraps=keyboard.KEY_EVENT, size=keyboard.KEY_EVENT.size)):
+			self.listener.handler(MagicMock(data=data))
+			self.assertEqual([32, 96], [c[0][1] for c in keyboard.KEY_EVENT.unpack_from.call_args_list])
+		self.assertEqual([('down', 1)], self.called())
+
+	def test_key_event_layout(self):
+		self.assertEqual(32, keyboard.KEY_EVENT.size)
+
+	def test_bind_twice_keeps_the_last_key(self):
+		self.listener.bind(Key(['<Ctrl>j'], 'other down'))
+		self.listener.bind(Key(['<Ctrl>q', 'w'], 'other window'))
+		self.press('<Ctrl>j')
+		self.press('<Ctrl>q')
+		self.press('w')
+		self.assertEqual([('other down', 1), ('prefix', 1), ('other window', 1)], self.called())
+
+	def test_sequence_ending_where_another_goes_on(self):
+		self.assertRaises(Exception, self.listener.bind, Key(['<Ctrl>q', 'g'], 'other'))
+
+	def test_sequence_going_on_where_another_ends(self):
+		self.assertRaises(Exception, self.listener.bind, Key(['<Ctrl>q', 'w', 't'], 'other'))
+		self.press('<Ctrl>q')
+		self.press('w')
+		self.press('t')
+		self.assertEqual([('prefix', 1), ('window', 1)], self.called())
+
+	def test_single_key_starting_a_sequence(self):
+		self.listener.bind(Key(['<Ctrl>j', 'w'], 'other'))
+		self.press('<Ctrl>j')
+		self.press('w')
+		self.assertEqual([('down', 1), ('other', 1)], self.called())
+
+
+class KeyTestCase(unittest.TestCase):
+
+	def test_accumulated_numeric_parameters(self):
+		key = Key(['<Ctrl>l'], 'increase', [0.05, 2], coalesce=True)
+		self.assertEqual([0.05, 2], key.accumulated_parameters(1))
+		self.assertEqual([0.05 * 3, 6], key.accumulated_parameters(3))
+
+	def test_accumulated_non_numeric_parameters(self):
+		key = Key(['<Ctrl>u'], 'change', ['C', True, [1], None, 1], coalesce=True)
+		self.assertEqual(['C', True, [1], None, 3], key.accumulated_parameters(3))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,7 +1,86 @@
-import unittest
+import configparser, os, tempfile, unittest
 import poco.layout as layout
-from unittest.mock import MagicMock
-from poco.layout import Layout
+import poco.state as state
+import poco.windows as windows
+from unittest.mock import MagicMock, patch
+from poco.layout import Layout, Monitor, Stack
+
+
+#
+# The list based layout functions the engine replaced, kept as the oracle of its arrangements
+#
+def monocle(stack, monitor):
+	layout = []
+	for c in stack:
+		layout.append([monitor.wx, monitor.wy, monitor.ww, monitor.wh])
+	return layout
+
+
+def tile(stack, monitor):
+	layout = []
+
+	if not stack:
+		return None
+	n = len(stack)
+
+	if n > monitor.nmaster:
+		mw = monitor.ww * monitor.mfact if monitor.nmaster else 0
+	else:
+		mw = monitor.ww
+	my = ty = 0
+	for i in range(len(stack)):
+		if i < monitor.nmaster:
+			h = (monitor.wh - my) / (min(n, monitor.nmaster) - i);
+			layout.append([monitor.wx, monitor.wy + my, mw, h])
+			my += layout[-1][3]
+		else:
+			h = (monitor.wh - ty) / (n - i);
+			layout.append([monitor.wx + mw, monitor.wy + ty, monitor.ww - mw, h])
+			ty += layout[-1][3]
+
+	return layout
+
+
+def centeredmaster(stack, monitor):
+	if not stack:
+		return None
+
+	layout = []
+	tw = mw = monitor.ww
+	mx = my = 0
+	oty = ety = 0
+	n = len(stack)
+
+	if n > monitor.nmaster:
+		mw = monitor.ww * monitor.mfact if monitor.nmaster else 0
+		tw = monitor.ww - mw
+
+		if n - monitor.nmaster > 1:
+			mx = (monitor.ww - mw) / 2
+			tw = (monitor.ww - mw) / 2
+
+	for i in range(len(stack)):
+		c = stack[i]
+		if i < monitor.nmaster:
+			# nmaster clients are stacked vertically, in the center of the screen
+			h = (monitor.wh - my) / (min(n, monitor.nmaster) - i)
+			layout.append([monitor.wx + mx, monitor.wy + my, mw, h])
+			my += h
+		else:
+			# stack clients are stacked vertically
+			if (i - monitor.nmaster) % 2:
+				h = (monitor.wh - ety) / int((1 + n - i) / 2)
+				layout.append([monitor.wx, monitor.wy + ety, tw, h])
+				ety += h
+			else:
+				h = (monitor.wh - oty) / int((1 + n - i) / 2)
+				layout.append([monitor.wx + mx + mw, monitor.wy + oty, tw, h])
+				oty += h
+
+	return layout
+
+
+FUNCTIONS_MAP = {'C': centeredmaster, 'T': tile, 'M': monocle}
 
 
 class LayoutTestCase(unittest.TestCase):
@@ -43,28 +122,593 @@ class LayoutTestCase(unittest.TestCase):
 
 	def test_centeredmaster_two_window(self):
 		print('**********************************************************************************************')
-		arrange = layout.centeredmaster([self.window_01, self.window_02], self.monitor)
+		arrange = centeredmaster([self.window_01, self.window_02], self.monitor)
 		for a in arrange:
 			print('x: {:10}   y: {:10}   w: {:10}   h: {:10}'.format(a[0], a[1], a[2], a[3]))
 
 	def test_centeredmaster_three_window(self):
 		print('**********************************************************************************************')
-		arrange = layout.centeredmaster([self.window_01, self.window_02, self.window_03], self.monitor)
+		arrange = centeredmaster([self.window_01, self.window_02, self.window_03], self.monitor)
 		for a in arrange:
 			print('x: {:10}   y: {:10}   w: {:10}   h: {:10}'.format(a[0], a[1], a[2], a[3]))
 
 	def test_centeredmaster_four_window(self):
 		print('**********************************************************************************************')
-		arrange = layout.centeredmaster([self.window_01, self.window_02, self.window_03, self.window_04], self.monitor)
+		arrange = centeredmaster([self.window_01, self.window_02, self.window_03, self.window_04], self.monitor)
 		for a in arrange:
 			print('x: {:10}   y: {:10}   w: {:10}   h: {:10}'.format(a[0], a[1], a[2], a[3]))
 
 	def test_centeredmaster_x_window(self):
 		print('**********************************************************************************************')
-		arrange = layout.centeredmaster(
+		arrange = centeredmaster(
 			[self.window_01, self.window_02, self.window_03, self.window_04, self.window_05], self.monitor)
 		for a in arrange:
 			print('x: {:10}   y: {:10}   w: {:10}   h: {:10}'.format(a[0], a[1], a[2], a[3]))
 
+	def test_arrange_is_pixel_identical_to_layout_functions(self):
+		monitor = Monitor()
+		for function_key, function in FUNCTIONS_MAP.items():
+			for wx, wy, ww, wh, gap in [(0, 0, 1920, 1080, 0), (10, 37, 1900, 1003, 10), (1930, 27, 1259, 997, 7)]:
+				monitor.set_workarea(wx, wy, ww, wh)
+				for nmaster in range(4):
+					for mfact in (0.1, 0.35, 0.5, 0.5 + 0.05 + 0.05 + 0.05, 0.9):
+						monitor.nmaster, monitor.mfact = nmaster, mfact
+						for n in range(1, 25):
+							expected = [
+								[int(a[0] + gap), int(a[1] + gap), int(a[2] - gap * 2), int(a[3] - gap * 2)]
+								for a in function(list(range(n)), monitor)]
+							geometry = layout.arrange(function_key, n, monitor, gap=gap)
+							self.assertEqual(expected, [list(map(int, row)) for row in geometry])
+
+	def test_arrange_is_memoized(self):
+		layout.clear_arrangements()
+		geometry = layout.arrange('T', 3, self.monitor, gap=10)
+		self.assertIs(geometry, layout.arrange('T', 3, self.monitor, gap=10))
+		self.assertIsNot(geometry, layout.arrange('T', 4, self.monitor, gap=10))
+		self.assertEqual(1, layout._arrange.cache_info().hits)
+		layout.clear_arrangements()
+		self.assertEqual(0, layout._arrange.cache_info().currsize)
+
+	def test_arrange_without_numpy(self):
+		numpy = layout.numpy
+		layout.numpy = None
+		layout.clear_arrangements()
+		try:
+			self.monitor.nmaster = 1
+			geometry = layout.arrange('T', 3, self.monitor, gap=10)
+			self.assertEqual([10, 60, 380, 530], list(geometry[0]))
+			self.assertEqual([410, 60, 380, 255], list(geometry[1]))
+		finally:
+			layout.numpy = numpy
+			layout.clear_arrangements()
+
+	def test_leaving_stack_window_keeps_master_slot(self):
+		before = layout.plan('T', [1, 2, 3], self.monitor)
+		after = layout.plan('T', [1, 2], self.monitor)
+		self.assertEqual([2], layout.changed_slots(before, after))
+
+	def test_joining_window_changes_its_slot(self):
+		before = layout.plan('T', [1, 2], self.monitor)
+		after = layout.plan('T', [1, 2, 3], self.monitor)
+		self.assertEqual([2, 3], layout.changed_slots(before, after))
+
+	def test_registered_layouts_fit_the_monitor(self):
+		layout.clear_arrangements()
+		for function_key in layout.LAYOUTS:
+			for n in range(1, 20):
+				geometry = layout.arrange(function_key, n, self.monitor)
+				self.assertEqual(n, len(geometry), function_key)
+				for x, y, w, h in geometry:
+					self.assertTrue(0 <= x and x + w <= 800 and 50 <= y and y + h <= 600, function_key)
+					self.assertTrue(w > 0 and h > 0, function_key)
+
+	def test_grid(self):
+		geometry = [list(g) for g in layout.arrange('G', 5, self.monitor)]
+		self.assertEqual([0, 50, 400, 275], geometry[0])
+		self.assertEqual([0, 325, 400, 275], geometry[1])
+		self.assertEqual([400, 50, 400, 183], geometry[2])
+		self.assertEqual([400, 416, 400, 183], geometry[4])
+
+	def test_bstack(self):
+		geometry = [list(g) for g in layout.arrange('B', 3, self.monitor)]
+		self.assertEqual([0, 50, 800, 275], geometry[0])
+		self.assertEqual([0, 325, 400, 275], geometry[1])
+		self.assertEqual([400, 325, 400, 275], geometry[2])
+
+	def test_dwindle(self):
+		geometry = [list(g) for g in layout.arrange('F', 3, self.monitor)]
+		self.assertEqual([0, 50, 400, 550], geometry[0])
+		self.assertEqual([400, 50, 400, 275], geometry[1])
+		self.assertEqual([400, 325, 400, 275], geometry[2])
+
+	def test_deck(self):
+		geometry = [list(g) for g in layout.arrange('D', 3, self.monitor)]
+		self.assertEqual([0, 50, 400, 550], geometry[0])
+		self.assertEqual([400, 50, 400, 550], geometry[1])
+		self.assertEqual(geometry[1], geometry[2])
+
+	def test_undeclared_parameters_share_arrangements(self):
+		layout.clear_arrangements()
+		grid = layout.arrange('G', 4, self.monitor)
+		bstack = layout.arrange('B', 4, self.monitor)
+		self.monitor.mfact = 0.7
+		self.assertIs(grid, layout.arrange('G', 4, self.monitor))
+		self.assertIsNot(bstack, layout.arrange('B', 4, self.monitor))
+
+
+class PlannerTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.request = layout.PlanRequest(
+			key=(0, 0), function_key='T', xids=(1, 2, 3), nmaster=1, mfact=0.5, workarea=(0, 50, 800, 550),
+			gap=0, previous={}, requested={}, active=True, revision=0)
+
+	def test_plan_monitor_skips_windows_in_their_requested_slots(self):
+		placement, candidates = layout.plan_monitor(self.request)
+		request = self.request._replace(previous=placement, requested={1: placement[1], 2: placement[2]})
+		self.assertEqual(placement, layout.plan_monitor(request)[0])
+		self.assertEqual([3], layout.plan_monitor(request)[1])
+		self.assertEqual([1, 2, 3], candidates)
+
+	def test_commits_the_latest_plan(self):
+		commit = MagicMock()
+		planner = layout.Planner(commit)
+		with patch.object(layout.GLib, 'idle_add', side_effect=lambda f, *args: f(*args)):
+			planner.submit([self.request])
+			planner.jobs.join()
+		commit.assert_called_once()
+		(request, placement, candidates), = commit.call_args[0][0]
+		self.assertEqual([1, 2, 3], candidates)
+		self.assertEqual(planner.generation, planner.done)
+
+	def test_drops_stale_plans(self):
+		commit = MagicMock()
+		planner = layout.Planner(commit)
+		planner.generation = 2
+		planner._commit(1, [])
+		commit.assert_not_called()
+		self.assertEqual(1, planner.dropped)
+		self.assertTrue(planner.pending())
+		planner._commit(2, [])
+		self.assertFalse(planner.pending())
+
+
+class RestoreTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.stack_state = {
+			'11': {'name': 'vim', 'identity': ['Gvim', '', 'vim'], 'stack_index': 1},
+			'12': {'name': 'term 1', 'identity': ['Terminal', '', 'term'], 'stack_index': 0},
+			'13': {'name': 'term 2', 'identity': ['Terminal', '', 'term'], 'stack_index': 2}}
+
+	def test_title_stem_ignores_numbers(self):
+		self.assertEqual(windows.title_stem('Terminal - pid 4521'), windows.title_stem('terminal  -  pid 17'))
+
+	def test_match_same_xids(self):
+		identities = {11: ('Gvim', '', 'vim'), 12: ('Terminal', '', 'term'), 13: ('Terminal', '', 'term')}
+		self.assertEqual({11: 1, 12: 0, 13: 2}, layout.match_saved_positions(identities, self.stack_state))
+
+	def test_match_new_xids_by_identity(self):
+		identities = {21: ('Terminal', '', 'term'), 22: ('Gvim', '', 'vim'), 23: ('Terminal', '', 'term')}
+		self.assertEqual({21: 0, 22: 1, 23: 2}, layout.match_saved_positions(identities, self.stack_state))
+
+	def test_reused_xid_of_other_window(self):
+		identities = {11: ('Firefox', '', 'mozilla firefox'), 31: ('Gvim', '', 'vim')}
+		self.assertEqual({31: 1}, layout.match_saved_positions(identities, self.stack_state))
+
+	def test_legacy_state_without_identity(self):
+		identities = {12: ('Terminal', '', 'term')}
+		self.assertEqual({12: 4}, layout.match_saved_positions(identities, {'12': {'name': 'term', 'stack_index': 4}}))
+
+
+class ScreenlessLayoutTestCase(unittest.TestCase):
+	"""
+	A layout over mocked windows, on two workspaces of two monitors
+	"""
+
+	def setUp(self):
+		self.workspaces = [MagicMock(), MagicMock()]
+		for number, workspace in enumerate(self.workspaces):
+			workspace.get_number.return_value = number
+		self.monitor_count = 2
+		self.patches = [
+			patch.object(layout, 'MONITORS'), patch.object(layout, 'identity_for'), patch.object(layout, 'GLib')]
+		for p in self.patches:
+			p.start()
+		layout.MONITORS.monitor_for.side_effect = lambda window: window.monitor
+		layout.MONITORS.count.side_effect = lambda: self.monitor_count
+		layout.MONITORS.workarea.side_effect = lambda i: MagicMock(
+			x=i * 800, y=0, width=800, height=600) if i < self.monitor_count else None
+		self.layout = Layout.__new__(Layout)
+		self.layout.gap = 0
+		self.layout.monitors = {}
+		self.layout.active_key = None
+		self.layout.default_monitor = Monitor()
+		self.layout.window_keys = {}
+		self.layout.identities = {}
+		self.layout.floating = set()
+		self.layout.window_handlers = {}
+		self.layout.journaling = False
+		self.layout.scheduled_apply_id = self.layout.settle_id = None
+		self.layout.held_placements = False
+		self.layout.planner = MagicMock()
+		self.layout.windows = MagicMock()
+		self.layout.windows.screen.get_active_workspace.return_value = self.workspaces[0]
+		self.layout._schedule_apply = MagicMock()
+
+	def tearDown(self):
+		for p in self.patches:
+			p.stop()
+
+	def window(self, xid, workspace=0, monitor=0):
+		window = MagicMock()
+		window.get_xid.return_value = xid
+		window.get_workspace.return_value = self.workspaces[workspace] if workspace is not None else None
+		window.monitor = monitor
+		self.layout._stack(window)
+		return window
+
+	def stacks(self):
+		return {key: list(monitor.stack) for key, monitor in self.layout.monitors.items() if monitor.stack}
+
+
+class MonitorsTestCase(ScreenlessLayoutTestCase):
+
+	def test_stack_per_workspace_and_monitor(self):
+		self.window(1, workspace=0, monitor=0)
+		self.window(2, workspace=0, monitor=1)
+		self.window(3, workspace=1, monitor=0)
+		self.window(4, workspace=0, monitor=1)
+		self.assertEqual({(0, 0): [1], (0, 1): [4, 2], (1, 0): [3]}, self.stacks())
+		self.assertEqual((0, 1), self.layout.window_keys[2])
+
+	def test_layout_per_workspace_and_monitor(self):
+		self.window(1, workspace=0, monitor=0)
+		self.window(2, workspace=0, monitor=1)
+		self.layout.monitors[(0, 1)].function_key = 'M'
+		self.layout.monitors[(0, 1)].mfact = 0.7
+		self.assertIsNone(self.layout.monitors[(0, 0)].function_key)
+		self.layout.active_key = (0, 1)
+		new_monitor = self.layout._get_monitor((1, 1))
+		self.assertEqual(('M', 0.7), (new_monitor.function_key, new_monitor.mfact))
+
+	def test_legacy_state_applies_to_monitors_created_later(self):
+		self.window(1, workspace=0, monitor=0)
+		self.layout.set_state({'nmaster': 2, 'mfact': 0.6, 'function': 'T', 'stack_state': {}})
+		for key in ((0, 0), (1, 1)):
+			monitor = self.layout._get_monitor(key)
+			self.assertEqual((2, 0.6, 'T'), (monitor.nmaster, monitor.mfact, monitor.function_key))
+
+	def test_window_moved_to_other_monitor(self):
+		window = self.window(1, workspace=0, monitor=0)
+		self.window(2, workspace=0, monitor=1)
+		window.monitor = 1
+		self.layout._window_moved(window)
+		self.assertEqual({(0, 1): [1, 2]}, self.stacks())
+		self.assertEqual((0, 1), self.layout.window_keys[1])
+		self.layout._schedule_apply.assert_called_once()
+
+	def test_own_geometry_request_skips_the_monitor_lookup(self):
+		window = self.window(1, workspace=0, monitor=0)
+		layout.MONITORS.monitor_for.reset_mock()
+		self.layout.windows.confirmed_request.return_value = (0, 0, 800, 600)
+		self.layout._window_geometry_changed(window)
+		layout.MONITORS.monitor_for.assert_not_called()
+
+	def test_window_moved_by_someone_else_to_other_monitor(self):
+		window = self.window(1, workspace=0, monitor=0)
+		self.window(2, workspace=0, monitor=1)
+		self.layout.windows.confirmed_request.return_value = None
+		window.monitor = 1
+		self.layout._window_geometry_changed(window)
+		self.assertEqual({(0, 1): [1, 2]}, self.stacks())
+
+	def test_without_active_workspace(self):
+		self.window(1, workspace=0, monitor=0)
+		self.layout.windows.screen.get_active_workspace.return_value = None
+		pinned = self.window(2, workspace=None, monitor=0)
+		self.assertEqual({(0, 0): [2, 1]}, self.stacks())
+		self.layout._window_moved(pinned)
+		self.layout._schedule_apply.assert_not_called()
+		self.layout.windows.active.get_wnck_window.return_value = None
+		self.layout.active_key = (1, 0)
+		self.assertIs(self.layout._get_monitor((1, 0)), self.layout.get_active_monitor())
+		self.layout.monitors[(0, 0)].function_key = 'T'
+		self.layout.apply()
+		requests, = self.layout.planner.submit.call_args[0]
+		self.assertEqual([((0, 0), False)], [(request.key, request.active) for request in requests])
+
+	def test_window_moved_inside_its_monitor(self):
+		window = self.window(1, workspace=0, monitor=0)
+		self.layout._window_moved(window)
+		self.layout._schedule_apply.assert_not_called()
+
+	def test_pinned_window_follows_the_active_workspace(self):
+		pinned = self.window(1, workspace=None, monitor=0)
+		pinned.is_pinned.return_value = True
+		self.window(2, workspace=1, monitor=0)
+		self.layout.windows.visible = [pinned]
+		self.layout.windows.screen.get_active_workspace.return_value = self.workspaces[1]
+		self.layout.apply = MagicMock()
+		self.layout._active_workspace_changed(None, self.workspaces[0])
+		self.assertEqual({(1, 0): [1, 2]}, self.stacks())
+		self.layout.apply.assert_called_once()
+
+	def test_unplugged_monitor_windows_fold_into_the_first_monitor(self):
+		self.window(1, workspace=0, monitor=0)
+		self.window(2, workspace=0, monitor=1)
+		self.window(3, workspace=0, monitor=1)
+		self.window(4, workspace=1, monitor=1)
+		self.monitor_count = 1
+		self.layout._monitors_changed()
+		self.assertEqual({(0, 0): [1, 3, 2], (1, 0): [4]}, self.stacks())
+		self.assertEqual((0, 0), self.layout.window_keys[2])
+		self.assertIn((0, 1), self.layout.monitors)
+		self.layout._schedule_apply.assert_called_once()
+
+	def test_folded_windows_survive_a_crash(self):
+		layout.identity_for.side_effect = lambda window: ('Terminal', '', 'term {}'.format(window.get_xid()))
+		self.window(1, workspace=0, monitor=0)
+		self.window(2, workspace=0, monitor=1)
+		self.layout.windows.names = {1: 'term 1', 2: 'term 2'}
+		with tempfile.TemporaryDirectory() as directory:
+			journal = state.Journal(os.path.join(directory, 'layout.journal'))
+			layout_file = os.path.join(directory, 'layout.json')
+			with patch.object(state, 'layout_file', layout_file), patch.object(state, 'JOURNAL', journal):
+				state.compact(self.layout)
+				self.layout.journaling = True
+				self.monitor_count = 1
+				self.layout._monitors_changed()
+				# no snapshot after the fold, as if poco crashed
+				snapshot = state.read_layout()
+			records = journal.read(journal.sequence)
+			journal.file.close()
+		self.assertEqual([state.REMOVE, state.INSERT, state.IDENTITY], [r[1] for r in records])
+		self.assertEqual(
+			{'name': 'term 2', 'identity': ['Terminal', '', 'term 2'], 'monitor': '0:0', 'stack_index': 1},
+			snapshot['stack_state']['2'])
+
+	def test_apply_skips_stale_monitors(self):
+		self.window(1, workspace=0, monitor=0)
+		self.window(2, workspace=0, monitor=1)
+		for monitor in self.layout.monitors.values():
+			monitor.function_key = 'T'
+		self.monitor_count = 1
+		self.layout.apply()
+		requests, = self.layout.planner.submit.call_args[0]
+		self.assertEqual([(0, 0)], [request.key for request in requests])
+
+	def test_topology_without_the_monitor(self):
+		topology = windows.MonitorTopology()
+		topology.display = MagicMock()
+		topology.display.get_n_monitors.return_value = 1
+		topology.display.get_monitor.side_effect = lambda i: MagicMock() if i < 1 else None
+		self.assertIsNone(topology.workarea(1))
+		self.assertEqual(0, topology.monitor_for(MagicMock()))
+
+
+class WorkspacesTestCase(ScreenlessLayoutTestCase):
+	"""
+	Plans committed as soon as they are submitted
+	"""
+
+	def setUp(self):
+		super().setUp()
+		self.layout.planner.submit.side_effect = lambda requests: self.layout._commit_plans(
+			[(request,) + layout.plan_monitor(request) for request in requests])
+		self.layout.reconfigured = self.layout.skipped = self.layout.skipped_total = 0
+		self.layout.windows.confirmed_request.return_value = None
+		self.layout.windows.is_arranged.return_value = False
+		self.stacked = [self.window(1, workspace=0), self.window(2, workspace=1), self.window(3, workspace=1)]
+		self.layout.windows.visible = [self.stacked[0]]
+		self.layout.windows.visible_map = {1: self.stacked[0]}
+		for monitor in self.layout.monitors.values():
+			monitor.function_key = 'T'
+
+	def planned(self):
+		requests, = self.layout.planner.submit.call_args[0]
+		return [(request.key, request.active) for request in requests]
+
+	def test_inactive_placement_is_kept(self):
+		self.layout.apply()
+		self.assertEqual([((0, 0), True), ((1, 0), False)], self.planned())
+		self.assertEqual({2, 3}, set(self.layout.monitors[(1, 0)].placement))
+		self.assertEqual(1, self.layout.windows.set_geometry.call_count)
+
+	def test_apply_plans_only_active_and_changed_monitors(self):
+		self.layout.apply()
+		self.layout.apply()
+		self.assertEqual([((0, 0), True)], self.planned())
+		self.window(4, workspace=1)
+		self.layout.apply()
+		self.assertEqual([((0, 0), True), ((1, 0), False)], self.planned())
+
+	def test_switch_arranges_from_the_kept_placement(self):
+		self.layout.apply()
+		placement = self.layout.monitors[(1, 0)].placement
+		self.layout.windows.set_geometry.reset_mock()
+		self.layout.windows.visible = self.stacked[1:]
+		self.layout.windows.visible_map = {2: self.stacked[1], 3: self.stacked[2]}
+		self.layout.windows.screen.get_active_workspace.return_value = self.workspaces[1]
+		self.layout._active_workspace_changed(None, self.workspaces[0])
+		self.assertEqual([], self.planned())
+		arranged = {c[0][0].get_xid(): (c[1]['x'], c[1]['y'], c[1]['w'], c[1]['h'])
+					for c in self.layout.windows.set_geometry.call_args_list}
+		self.assertEqual(placement, arranged)
+
+	def test_switch_plans_changed_monitors(self):
+		self.layout.apply()
+		self.layout.monitors[(1, 0)].stack.move(3, 0)
+		self.layout._record(layout.state.MOVE, (1, 0), 3, 0)
+		self.layout.windows.visible_map = {2: self.stacked[1], 3: self.stacked[2]}
+		self.layout.windows.screen.get_active_workspace.return_value = self.workspaces[1]
+		self.layout._active_workspace_changed(None, self.workspaces[0])
+		self.assertEqual([((1, 0), True)], self.planned())
+
+
+class LayoutRulesTestCase(ScreenlessLayoutTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.patches.append(patch.object(layout, 'RULES'))
+		self.patches[-1].start()
+		self.floating = set()
+		layout.RULES.match.side_effect = lambda window: MagicMock(floating=window.get_xid() in self.floating)
+		self.windows = [self.window(1, workspace=0), self.window(2, workspace=1), self.window(3, workspace=1)]
+		self.layout.windows.screen.get_windows.return_value = self.windows
+		self.layout.windows.buffers_map = {1: self.windows[0]}
+
+	def test_floating_rule_on_other_workspaces(self):
+		self.floating = {1, 2}
+		self.layout.apply_rules()
+		self.assertEqual({(1, 0): [3]}, self.stacks())
+		self.assertEqual({1, 2}, self.layout.floating)
+		self.layout._schedule_apply.assert_called_once()
+
+	def test_window_no_longer_floating_is_stacked_back(self):
+		self.floating = {2}
+		self.layout.apply_rules()
+		self.floating = set()
+		self.layout.apply_rules()
+		self.assertEqual({(0, 0): [1], (1, 0): [2, 3]}, self.stacks())
+		self.assertEqual(set(), self.layout.floating)
+
+	def test_unchanged_rules(self):
+		self.layout.apply_rules()
+		self.layout._schedule_apply.assert_not_called()
+
+
+class PlacementTestCase(ScreenlessLayoutTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.layout.planner.pending.return_value = False
+		self.layout.reconfigured = self.layout.skipped = self.layout.skipped_total = 0
+		self.layout._get_monitor((0, 0)).function_key = 'T'
+		self.layout.windows.confirmed_request.return_value = None
+		self.layout.windows.is_arranged.return_value = False
+		self.layout.windows.visible_map = {}
+
+	def open(self, xid):
+		window = self.window(xid)
+		self.layout.windows.visible_map[xid] = window
+		self.layout._place(window)
+		return window
+
+	def test_window_opened_on_a_settled_layout_is_placed_at_once(self):
+		self.open(1)
+		self.layout.windows.set_geometry.assert_called_once()
+		self.layout._schedule_apply.assert_not_called()
+		self.layout.planner.submit.assert_not_called()
+
+	def test_burst_of_opened_windows_is_tiled_by_a_single_apply(self):
+		for xid in range(1, 16):
+			self.open(xid)
+		self.assertEqual(1, self.layout.windows.set_geometry.call_count)
+		self.layout._schedule_apply.assert_not_called()
+		self.layout._settled()
+		self.layout._schedule_apply.assert_called_once()
+		self.assertIsNone(self.layout.settle_id)
+
+	def test_window_opened_while_planning_waits_for_the_plan(self):
+		self.layout.planner.pending.return_value = True
+		self.open(1)
+		self.layout.windows.set_geometry.assert_not_called()
+		self.assertTrue(self.layout.held_placements)
+
+	def test_settles_without_held_windows(self):
+		self.open(1)
+		self.layout._settled()
+		self.layout._schedule_apply.assert_not_called()
+
+
+class SchedulerTestCase(ScreenlessLayoutTestCase):
+
+	def setUp(self):
+		super().setUp()
+		del self.layout._schedule_apply
+		self.get_relayout_delay = layout.configurations.get_relayout_delay
+		self.patches.append(patch.object(layout.configurations, 'get_relayout_delay', return_value=40))
+		self.patches[-1].start()
+		layout.GLib.timeout_add.return_value = layout.GLib.idle_add.return_value = 7
+		self.layout.windows.visible_map = {}
+		self.stacked = [self.window(xid) for xid in range(1, 6)]
+		self.layout._get_monitor((0, 0)).function_key = 'T'
+
+	def test_burst_of_window_events_schedules_one_apply(self):
+		for window in self.stacked:
+			self.layout._window_closed(None, window)
+		layout.GLib.timeout_add.assert_called_once_with(40, self.layout._scheduled_apply)
+		self.layout.planner.submit.assert_not_called()
+		self.assertFalse(self.layout._scheduled_apply())
+		self.layout.planner.submit.assert_called_once()
+		self.assertIsNone(self.layout.scheduled_apply_id)
+		layout.GLib.source_remove.assert_not_called()
+
+	def test_apply_cancels_the_scheduled_apply(self):
+		self.layout._window_closed(None, self.stacked[0])
+		self.layout.apply()
+		layout.GLib.source_remove.assert_called_once_with(7)
+		self.assertIsNone(self.layout.scheduled_apply_id)
+		self.layout._window_closed(None, self.stacked[1])
+		self.assertEqual(2, layout.GLib.timeout_add.call_count)
+
+	def test_relayout_delay(self):
+		layout.configurations.get_relayout_delay.return_value = 120
+		self.layout._window_closed(None, self.stacked[0])
+		layout.GLib.timeout_add.assert_called_once_with(120, self.layout._scheduled_apply)
+		layout.GLib.idle_add.assert_not_called()
+
+	def test_invalid_relayout_delay_falls_back_to_the_default(self):
+		parser = configparser.ConfigParser(interpolation=None)
+		parser.read_dict({'layout': {'relayout_delay': '250ms'}})
+		with patch.object(layout.configurations, 'parser', parser):
+			self.assertEqual(int(layout.configurations.DEFAULT_RELAYOUT_DELAY), self.get_relayout_delay())
+
+	def test_no_relayout_delay_applies_on_idle(self):
+		layout.configurations.get_relayout_delay.return_value = 0
+		self.layout._window_closed(None, self.stacked[0])
+		self.layout._window_closed(None, self.stacked[1])
+		layout.GLib.idle_add.assert_called_once_with(self.layout._scheduled_apply)
+		layout.GLib.timeout_add.assert_not_called()
+
+
+class StackTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.stack = Stack([10, 20, 30, 40])
+
+	def assertIndexed(self, xids):
+		self.assertEqual(xids, list(self.stack))
+		for i, xid in enumerate(xids):
+			self.assertEqual(i, self.stack.index(xid))
+		self.assertEqual(len(xids), len(self.stack.positions))
+
+	def test_insert(self):
+		self.stack.insert(0, 50)
+		self.assertIndexed([50, 10, 20, 30, 40])
+
+	def test_insert_known_xid_moves_it(self):
+		self.stack.insert(0, 30)
+		self.assertIndexed([30, 10, 20, 40])
+
+	def test_remove(self):
+		self.stack.remove(20)
+		self.assertIndexed([10, 30, 40])
+		self.assertNotIn(20, self.stack)
+
+	def test_promote(self):
+		self.stack.promote(40)
+		self.assertIndexed([40, 10, 20, 30])
+
+	def test_move_down(self):
+		self.stack.move(10, 2)
+		self.assertIndexed([20, 30, 10, 40])
+
+	def test_sort(self):
+		self.stack.sort(key=lambda xid: -self.stack.index(xid))
+		self.assertIndexed([40, 30, 20, 10])
+
+
 if __name__ == '__main__':
 	unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import poco.names as names
 from poco.names import PromptInput
 
 
@@ -81,6 +82,15 @@ class CommandInputTestCase(unittest.TestCase):
 		self.assertEqual(i.terminal_command_spacer, '')
 		self.assertEqual(i.terminal_command_parameter, '')
 
+	def test_count_defaults_to_one(self):
+		self.assertEqual(1, PromptInput(text='buffers').parse().count)
+
+	def test_counted_command(self):
+		def command(c_in):
+			pass
+		self.assertFalse(names.is_counted(command))
+		self.assertTrue(names.is_counted(names.counted(command)))
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import poco.rules as rules
+from unittest.mock import MagicMock, patch
+from poco.rules import Rule, Rules
+
+
+def window(class_name='Gimp', instance_name='gimp', role='', window_type='normal', title=''):
+	w = MagicMock()
+	w.get_class_group_name.return_value = class_name
+	w.get_class_instance_name.return_value = instance_name
+	w.get_role.return_value = role
+	w.get_window_type.return_value.value_nick = window_type
+	w.get_name.return_value = title
+	return w
+
+
+class RulesTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.rules = Rules()
+
+	def test_no_rules(self):
+		self.assertIsNone(self.rules.match(window()))
+
+	def test_match_class_case_insensitive(self):
+		rule = Rule(wm_class='GIMP', floating=True)
+		self.rules.load([rule])
+		self.assertIs(rule, self.rules.match(window()))
+		self.assertIsNone(self.rules.match(window(class_name='Firefox', instance_name='Navigator')))
+
+	def test_match_instance_name(self):
+		rule = Rule(wm_class='navigator', workspace=3)
+		self.rules.load([rule])
+		self.assertIs(rule, self.rules.match(window(class_name='Firefox', instance_name='Navigator')))
+
+	def test_match_type_and_title(self):
+		dialog = Rule(window_type='dialog', floating=True)
+		mail = Rule(title='^Inbox', workspace=3)
+		self.rules.load([dialog, mail])
+		self.assertIs(dialog, self.rules.match(window(window_type='dialog')))
+		self.assertIs(mail, self.rules.match(window(title='Inbox - Mail')))
+		self.assertIsNone(self.rules.match(window(title='Mail - Inbox')))
+
+	def test_first_declared_rule_wins(self):
+		dialog = Rule(window_type='dialog', floating=True)
+		gimp = Rule(wm_class='gimp', workspace=2)
+		self.rules.load([dialog, gimp])
+		self.assertIs(dialog, self.rules.match(window(window_type='dialog')))
+		self.assertIs(gimp, self.rules.match(window()))
+
+	def test_match_role(self):
+		rule = Rule(wm_class='gimp', role='gimp-toolbox', floating=True)
+		self.rules.load([rule])
+		self.assertIs(rule, self.rules.match(window(role='gimp-toolbox')))
+		self.assertIsNone(self.rules.match(window(role='gimp-image-window')))
+
+	def test_instance_rule_not_hidden_by_group_rule(self):
+		firefox = Rule(wm_class='firefox', role='browser', workspace=2)
+		navigator = Rule(wm_class='navigator', floating=True)
+		self.rules.load([firefox, navigator])
+		self.assertIs(navigator, self.rules.match(window(class_name='Firefox', instance_name='Navigator')))
+		self.assertIs(firefox, self.rules.match(
+			window(class_name='Firefox', instance_name='Navigator', role='browser')))
+
+	def test_workspace_from_configurations(self):
+		options = [{'class': 'gimp', 'workspace': '2'}, {'class': 'mpv'}]
+		with patch.object(rules.configurations, 'get_rules', return_value=options):
+			self.assertEqual([2, None], [r.workspace for r in rules.from_configurations()])
+
+	def test_workspace_out_of_range_is_ignored(self):
+		options = [{'class': 'gimp', 'workspace': '0'}, {'class': 'mpv', 'workspace': '-1', 'float': 'true'}]
+		with patch.object(rules.configurations, 'get_rules', return_value=options):
+			loaded = rules.from_configurations()
+		self.assertEqual([None, None], [r.workspace for r in loaded])
+		self.assertTrue(loaded[1].floating)
+
+	def test_invalid_title_pattern_is_ignored(self):
+		options = [{'class': 'gimp', 'title': '(unclosed'}, {'class': 'mpv', 'title': '^mpv'}]
+		with patch.object(rules.configurations, 'get_rules', return_value=options):
+			loaded = rules.from_configurations()
+		self.assertEqual(['mpv'], [r.wm_class for r in loaded])
+
+
+if __name__ == '__main__':
+	unittest.main()
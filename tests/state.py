@@ -0,0 +1,147 @@
+import os, json, tempfile, unittest
+import poco.state as state
+from unittest.mock import MagicMock, patch
+from poco.layout import Monitor
+from poco.state import WriteBehind, Journal
+
+
+class WriteBehindTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, 'layout.json')
+		self.writer = WriteBehind(self.path, dict, json.dumps)
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_flush_writes_the_last_marked_state(self):
+		self.writer.mark({'monitors': {'0:0': 0.5}})
+		self.writer.mark({'monitors': {'0:0': 0.55}})
+		self.assertFalse(os.path.exists(self.path))
+		self.writer.flush()
+		with open(self.path) as f:
+			self.assertEqual({'monitors': {'0:0': 0.55}}, json.load(f))
+		self.assertEqual(['layout.json'], os.listdir(self.directory.name))
+
+	def test_unchanged_state_is_not_written(self):
+		self.writer.mark({'monitors': {'0:0': 0.5}})
+		self.writer.flush()
+		self.writer.mark({'monitors': {'0:0': 0.5}})
+		self.writer.flush()
+		self.writer.flush()
+		self.assertEqual(1, self.writer.writes)
+		self.assertEqual(1, self.writer.skipped)
+
+	def test_changed_state_is_written(self):
+		self.writer.mark({'monitors': {'0:0': 0.5, '0:1': 0.5}})
+		self.writer.flush()
+		self.writer.mark({'monitors': {'0:0': 0.55}})
+		self.writer.flush()
+		with open(self.path) as f:
+			self.assertEqual({'monitors': {'0:0': 0.55}}, json.load(f))
+		self.assertEqual(2, self.writer.writes)
+
+	def test_first_flush_writes_an_empty_state(self):
+		self.writer.mark({'decorations': {}})
+		self.writer.flush()
+		self.assertTrue(os.path.exists(self.path))
+
+
+class JournalTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, 'layout.journal')
+		self.journal = Journal(self.path)
+		self.journal.sequence = 3
+		self.snapshot = {
+			'journal': 3,
+			'monitors': {'0:0': {'nmaster': 1, 'mfact': 0.5, 'function': 'T'}},
+			'stack_state': {
+				'11': {'name': 'a', 'monitor': '0:0', 'stack_index': 0},
+				'12': {'name': 'b', 'monitor': '0:0', 'stack_index': 1}}}
+
+	def tearDown(self):
+		if self.journal.file:
+			self.journal.file.close()
+		self.directory.cleanup()
+
+	def stack(self, snapshot, monitor_key='0:0'):
+		entries = [(e['stack_index'], int(k)) for k, e in snapshot['stack_state'].items() if e['monitor'] == monitor_key]
+		return [xid for i, xid in sorted(entries)]
+
+	def test_read_appended_records(self):
+		self.journal.append(state.INSERT, (0, 0), xid=13, value=0)
+		self.journal.append(state.MONITOR, (0, 0), function=ord('M'), xid=2, value=0.6)
+		self.assertEqual(state.JOURNAL_HEADER.size + 2 * state.JOURNAL_RECORD.size, os.path.getsize(self.path))
+		records = Journal(self.path).read(3)
+		self.assertEqual([state.INSERT, state.MONITOR], [r[1] for r in records])
+		self.assertEqual((0, 0, ord('M'), 2, 0.6), records[1][2:])
+
+	def test_journal_of_other_snapshot_is_ignored(self):
+		self.journal.append(state.REMOVE, (0, 0), xid=11)
+		self.assertEqual([], Journal(self.path).read(4))
+
+	def test_torn_record_is_ignored(self):
+		self.journal.append(state.REMOVE, (0, 0), xid=11)
+		self.journal.file.write(b'\x01\x02\x03')
+		self.assertEqual(1, len(Journal(self.path).read(3)))
+
+	def test_replay(self):
+		for operation, xid, value in ((state.INSERT, 13, 0), (state.MOVE, 12, 0), (state.REMOVE, 11, 0)):
+			self.journal.append(operation, (0, 0), xid=xid, value=value)
+		self.journal.append(state.MONITOR, (1, 0), function=ord('G'), xid=0, value=0.5)
+		self.journal.append(state.INSERT, (1, 0), xid=12, value=0)
+		snapshot = state.replay(self.snapshot, Journal(self.path).read(3))
+		self.assertEqual([13], self.stack(snapshot))
+		self.assertEqual([12], self.stack(snapshot, '1:0'))
+		self.assertNotIn('11', snapshot['stack_state'])
+		self.assertEqual({'nmaster': 0, 'mfact': 0.5, 'function': 'G'}, snapshot['monitors']['1:0'])
+
+	def test_replay_of_a_window_moved_to_other_monitor(self):
+		self.snapshot['stack_state']['12']['identity'] = ['Terminal', '', 'term']
+		self.journal.append(state.REMOVE, (0, 0), xid=12)
+		self.journal.append(state.INSERT, (0, 1), xid=12, value=0)
+		snapshot = state.replay(self.snapshot, Journal(self.path).read(3))
+		self.assertEqual(
+			{'name': 'b', 'identity': ['Terminal', '', 'term'], 'monitor': '0:1', 'stack_index': 0},
+			snapshot['stack_state']['12'])
+		self.assertEqual([11], self.stack(snapshot))
+
+	def test_replay_identity(self):
+		self.journal.append(state.INSERT, (0, 0), xid=13, value=0)
+		self.journal.append(state.IDENTITY, (0, 0), xid=13, payload=b'["Gvim", "", "vim"]')
+		records = Journal(self.path).read(3)
+		self.assertEqual(('Gvim', '', 'vim'), records[1][6])
+		snapshot = state.replay(self.snapshot, records)
+		self.assertEqual(['Gvim', '', 'vim'], snapshot['stack_state']['13']['identity'])
+
+	def test_torn_identity_is_ignored(self):
+		self.journal.append(state.INSERT, (0, 0), xid=13, value=0)
+		self.journal.append(state.IDENTITY, (0, 0), xid=13, payload=b'["Gvim", "", "vim"]')
+		self.journal.file.truncate(os.path.getsize(self.path) - 3)
+		self.assertEqual([state.INSERT], [r[1] for r in Journal(self.path).read(3)])
+
+	def test_workspace_and_monitor_numbers_above_a_byte(self):
+		self.journal.append(state.INSERT, (300, 256), xid=13, value=0)
+		self.assertEqual((300, 256), Journal(self.path).read(3)[0][2:4])
+
+	def test_compact(self):
+		layout = MagicMock(monitors={}, window_keys={11: (0, 0)}, identities={11: ('Gvim', '', 'vim')})
+		layout.monitors[(0, 0)] = Monitor(function_key='T')
+		layout.monitors[(0, 0)].stack.insert(0, 11)
+		layout.windows.names = {11: 'vim'}
+		layout_file = os.path.join(self.directory.name, 'layout.json')
+		with patch.object(state, 'layout_file', layout_file), patch.object(state, 'JOURNAL', self.journal):
+			state.compact(layout)
+			self.journal.append(state.REMOVE, (0, 0), xid=11)
+			snapshot = state.read_layout()
+		self.assertEqual(4, snapshot['journal'])
+		self.assertEqual({}, snapshot['stack_state'])
+		self.assertEqual('T', snapshot['monitors']['0:0']['function'])
+		self.assertEqual(1, self.journal.snapshots)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,237 @@
+import unittest
+import poco.windows as windows
+from unittest.mock import MagicMock, patch
+from poco.windows import Windows, Transaction, Wnck, X, Xutil
+
+SLOT = (10, 60, 380, 530)
+
+
+class ArrangedTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.windows = Windows()
+		self.window = MagicMock()
+		self.window.get_xid.return_value = 1
+		self.windows.arranged[1] = (SLOT, None)
+
+	def configure(self, x, y, w, h):
+		self.window.get_geometry.return_value = (x, y, w, h)
+		self.window.get_client_window_geometry.return_value = (x, y, w, h)
+		self.windows._window_geometry_changed(self.window)
+
+	def test_configured_request(self):
+		self.configure(*SLOT)
+		self.assertTrue(self.windows.is_arranged(self.window, *SLOT))
+		self.assertEqual(SLOT, self.windows.confirmed_request(1))
+
+	def test_size_increments_agree_with_the_request(self):
+		self.configure(10, 60, 374, 522)
+		self.assertTrue(self.windows.is_arranged(self.window, *SLOT))
+
+	def test_moved_before_the_request_was_configured(self):
+		self.configure(700, 300, 200, 150)
+		self.assertFalse(self.windows.is_arranged(self.window, *SLOT))
+		self.assertIsNone(self.windows.confirmed_request(1))
+
+	def test_request_configured_after_a_step(self):
+		self.configure(10, 60, 200, 150)
+		self.configure(*SLOT)
+		self.assertTrue(self.windows.is_arranged(self.window, *SLOT))
+
+	def test_moved_after_the_request_was_configured(self):
+		self.configure(*SLOT)
+		self.configure(700, 300, 200, 150)
+		self.assertNotIn(1, self.windows.arranged)
+		self.assertFalse(self.windows.is_arranged(self.window, *SLOT))
+
+
+class WindowModelTestCase(unittest.TestCase):
+	"""
+	The window model kept current by the Wnck signals, over a mocked screen of two workspaces
+	"""
+
+	def setUp(self):
+		self.workspaces = [MagicMock(), MagicMock()]
+		self.screen_windows = []
+		self.screen = MagicMock()
+		self.screen.get_active_workspace.return_value = self.workspaces[0]
+		self.screen.get_windows.side_effect = lambda: list(self.screen_windows)
+		self.screen.get_windows_stacked.side_effect = lambda: list(self.screen_windows)
+		self.windows = Windows()
+		self.windows.screen = self.screen
+
+	def open(self, xid, x, y, workspace=0):
+		window = MagicMock()
+		window.get_xid.return_value = xid
+		window.get_pid.return_value = 0
+		window.get_name.return_value = 'window {}'.format(xid)
+		window.is_skip_tasklist.return_value = False
+		window.is_minimized.return_value = False
+		window.workspace = workspace
+		window.is_in_viewport.side_effect = lambda w: w is self.workspaces[window.workspace]
+		window.get_geometry.return_value = (x, y, 100, 100)
+		window.get_client_window_geometry.return_value = (x, y, 100, 100)
+		self.screen_windows.append(window)
+		self.windows._window_opened(self.screen, window)
+		return window
+
+	def assertModel(self, buffers, line, column):
+		self.windows.refresh()
+		self.assertEqual(buffers, [w.get_xid() for w in self.windows.buffers])
+		self.assertEqual(set(line), set(self.windows.visible_map))
+		self.assertEqual({xid: i for i, xid in enumerate(line)}, self.windows.line_index)
+		self.assertEqual({xid: i for i, xid in enumerate(column)}, self.windows.column_index)
+
+	def test_opened_windows(self):
+		self.open(1, 500, 0)
+		self.open(2, 0, 0)
+		self.open(3, 0, 300)
+		self.open(4, 0, 0, workspace=1)
+		self.assertModel([1, 2, 3], line=[2, 3, 1], column=[2, 1, 3])
+
+	def test_closed_window(self):
+		self.open(1, 500, 0)
+		window = self.open(2, 0, 0)
+		self.open(3, 0, 300)
+		self.windows.refresh()
+		self.screen_windows.remove(window)
+		self.windows._window_closed(self.screen, window)
+		self.assertModel([1, 3], line=[3, 1], column=[1, 3])
+		self.assertNotIn(2, self.windows.names)
+
+	def test_removed_window_stays_until_closed(self):
+		self.open(1, 500, 0)
+		window = self.open(2, 0, 0)
+		self.windows.refresh()
+		self.windows.remove(window, 0)
+		window.close.assert_called_once_with(0)
+		self.assertModel([1, 2], line=[2, 1], column=[2, 1])
+		self.screen_windows.remove(window)
+		self.windows._window_closed(self.screen, window)
+		self.assertModel([1], line=[1], column=[1])
+		self.assertEqual(1, self.windows.active.xid)
+
+	def test_minimized_window(self):
+		self.open(1, 500, 0)
+		window = self.open(2, 0, 0)
+		self.windows.refresh()
+		window.is_minimized.return_value = True
+		self.windows._window_state_changed(window, Wnck.WindowState.MINIMIZED, Wnck.WindowState.MINIMIZED)
+		self.assertModel([1, 2], line=[1], column=[1])
+
+	def test_unminimized_window_keeps_its_screen_order(self):
+		window = self.open(1, 500, 0)
+		self.open(2, 0, 0)
+		window.is_minimized.return_value = True
+		self.windows._window_state_changed(window, Wnck.WindowState.MINIMIZED, Wnck.WindowState.MINIMIZED)
+		window.is_minimized.return_value = False
+		self.windows._window_state_changed(window, Wnck.WindowState.MINIMIZED, 0)
+		self.assertModel([1, 2], line=[2, 1], column=[2, 1])
+
+	def test_state_change_not_affecting_the_model(self):
+		self.open(1, 500, 0)
+		window = self.open(2, 0, 0)
+		self.windows.refresh()
+		window.is_minimized.return_value = True
+		self.windows._window_state_changed(window, Wnck.WindowState.ABOVE, Wnck.WindowState.ABOVE)
+		self.assertModel([1, 2], line=[2, 1], column=[2, 1])
+
+	def test_window_moved_to_other_workspace(self):
+		self.open(1, 500, 0)
+		window = self.open(2, 0, 0)
+		self.windows.refresh()
+		window.workspace = 1
+		self.windows._window_workspace_changed(window)
+		self.assertModel([1], line=[1], column=[1])
+
+	def test_active_workspace_changed(self):
+		self.open(1, 500, 0)
+		self.open(2, 0, 0, workspace=1)
+		self.open(3, 0, 300, workspace=1)
+		self.windows.refresh()
+		self.screen.get_active_workspace.return_value = self.workspaces[1]
+		self.windows._active_workspace_changed(self.screen, self.workspaces[0])
+		self.assertModel([2, 3], line=[2, 3], column=[2, 3])
+		self.assertEqual(3, self.windows.active.xid)
+
+	def test_windows_of_every_workspace_listed(self):
+		self.windows.list_workspaces = True
+		self.open(1, 500, 0)
+		self.open(2, 0, 0, workspace=1)
+		self.assertModel([1, 2], line=[1], column=[1])
+
+
+class TransactionTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.connection = MagicMock()
+		self.connection.get_atom.side_effect = lambda name: name
+		self.transaction = Transaction(self.connection)
+		self.patch = patch.object(windows, 'event')
+		self.patch.start()
+
+	def tearDown(self):
+		self.patch.stop()
+
+	def sent(self):
+		"""
+		The atom name, target window and data of each client message sent to the root window
+		"""
+		messages = []
+		for message_call in windows.event.ClientMessage.call_args_list:
+			kwargs = message_call[1]
+			messages.append((kwargs['client_type'], kwargs['window'], kwargs['data'][1]))
+		return messages
+
+	def test_geometry_request(self):
+		self.transaction.set_geometry(1, 10.7, 60, 380, 530.2)
+		self.transaction.commit()
+		(atom_name, window, data), = self.sent()
+		self.assertEqual('_NET_MOVERESIZE_WINDOW', atom_name)
+		self.connection.create_resource_object.assert_called_once_with('window', 1)
+		flags = data[0]
+		self.assertEqual(X.StaticGravity, flags & 0xff)
+		# x, y, width and height are all set
+		self.assertEqual(0b1111, flags >> 8 & 0b1111)
+		# requested by a pager
+		self.assertEqual(2, flags >> 12)
+		self.assertEqual([10, 60, 380, 530], data[1:])
+
+	def test_minimize_and_close_requests(self):
+		self.transaction.minimize(1)
+		self.transaction.close(2, 1234)
+		self.transaction.close(3, None)
+		self.transaction.commit()
+		minimize, close, close_now = self.sent()
+		self.assertEqual(('WM_CHANGE_STATE', Xutil.IconicState), (minimize[0], minimize[2][0]))
+		self.assertEqual(('_NET_CLOSE_WINDOW', 1234, 2), (close[0], close[2][0], close[2][1]))
+		self.assertEqual(X.CurrentTime, close_now[2][0])
+
+	def test_single_flush_per_commit(self):
+		for xid in range(1, 6):
+			self.transaction.set_geometry(xid, 0, 0, 100, 100)
+		self.transaction.commit()
+		root = self.connection.screen().root
+		self.assertEqual(5, root.send_event.call_count)
+		self.connection.flush.assert_called_once()
+		self.assertEqual([], self.transaction.requests)
+
+	def test_empty_commit_sends_nothing(self):
+		self.transaction.commit()
+		windows.event.ClientMessage.assert_not_called()
+		self.connection.screen.assert_not_called()
+		self.connection.flush.assert_not_called()
+
+	def test_windows_geometry_in_a_transaction(self):
+		window = MagicMock()
+		window.get_xid.return_value = 1
+		window.get_geometry.return_value = window.get_client_window_geometry.return_value = (0, 0, 50, 50)
+		with patch.object(windows, 'decoration_size_for', return_value=(False, 0, 0, 0)):
+			Windows().set_geometry(window, x=10, y=60, w=380, h=530, transaction=self.transaction)
+		window.set_geometry.assert_not_called()
+		self.assertEqual(
+			[('_NET_MOVERESIZE_WINDOW', 1, [windows.MOVERESIZE_FLAGS, 10, 60, 380, 530])], self.transaction.requests)
+
+
+if __name__ == '__main__':
+	unittest.main()